@@ -20,18 +20,23 @@ LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
 FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
 DEALINGS IN THE SOFTWARE.
 """
+import collections
+import datetime
+import hashlib
 import json
 import logging
 import os.path
+import socket
+import sys
 import time
 from enum import Enum
 
 import requests
 import tibiapy
 import yaml
-from tibiapy.models import Guild
-from tibiapy.parsers import CharacterParser, GuildParser
-from tibiapy.urls import get_character_url, get_guild_url
+from tibiapy.models import Guild, GuildInvite, GuildMember, GuildsSection
+from tibiapy.parsers import CharacterParser, GuildParser, GuildsSectionParser
+from tibiapy.urls import get_character_url, get_guild_url, get_world_guilds_url
 
 log = logging.getLogger(__name__)
 log.setLevel(logging.DEBUG)
@@ -55,6 +60,12 @@ CLR_GUILDHALL_CHANGED = 0xFFFFFF  # White
 CLR_DISBAND_NEW = 0xE59400  # Darker orange
 CLR_DISBAND_REMOVE = 0x08CC8F  # Strong cyan/Lime green
 CLR_APPLICATIONS = 0xF5F5DC  # Beige
+CLR_GUILD_CREATED = 0x3498DB  # Blue
+CLR_GUILD_DISBANDED = 0x8B0000  # Dark red
+CLR_GUILD_RENAMED = 0x1ABC9C  # Teal
+CLR_LEVEL_MILESTONE = 0x9B59B6  # Purple
+CLR_VOCATION_PROMOTED = 0xFFD700  # Gold
+CLR_MOVED = 0xFF4500  # Orange red
 
 # Change strings
 # m -> Member related to the change
@@ -70,6 +81,11 @@ FMT_GUILDHALL_CHANGED = "Guild moved to guildhall **{extra}**"
 FMT_GUILDHALL_REMOVE = "Guild no longer owns guildhall **{extra}**"
 FMT_DISBAND_REMOVE = "Guild no longer in risk of being disbanded."
 FMT_DISBAND_NEW = "Guild will be disbanded on **{extra[1]}** {extra[0]}."
+FMT_LEVEL_MILESTONE = "[{m.name}]({m.url}) - Reached level **{extra}** - **{m.level}** **{v}** {e}\n"
+FMT_VOCATION_PROMOTED = "[{m.name}]({m.url}) - {extra} → **{v}** {e} - **{m.level}**\n"
+FMT_MOVED = "[{m.name}]({m.url}) - **{m.level}** **{v}** {e} - Moved to [{extra}]({url})\n"
+FMT_GUILD = "[{extra}]({url})\n"
+FMT_GUILD_RENAMED = "{extra[0]} → [{extra[1]}]({url})\n"
 
 
 class Change:
@@ -108,12 +124,29 @@ class ChangeType(Enum):
     NEW_DISBAND_WARNING = 12  #: Guild is going to be disbanded
     REMOVED_DISBAND_WARNING = 13  #: Guild no longer in danger of being disbanded
     APPLICATIONS_CHANGE = 14  #: The application status changed
+    GUILD_CREATED = 15  #: A new guild was found in the world.
+    GUILD_DISBANDED = 16  #: A guild is no longer in the world.
+    GUILD_RENAMED = 17  #: A guild changed its name.
+    LEVEL_MILESTONE = 18  #: Member reached a level milestone.
+    VOCATION_PROMOTED = 19  #: Member was promoted to a higher vocation.
+    MOVED = 20  #: Member left the guild to join another watched guild.
 
 
 class ConfigGuild:
-    def __init__(self, name, webhook_url):
+    def __init__(self, name, webhook_url, digest_window=0):
         self.name = name
         self.webhook_url = webhook_url
+        self.digest_window = digest_window
+
+    def __repr__(self):
+        return "<%s name=%r webhook_url=%r>" % (self.__class__.__name__, self.name, self.webhook_url)
+
+
+class ConfigWorld:
+    def __init__(self, name, webhook_url, digest_window=0):
+        self.name = name
+        self.webhook_url = webhook_url
+        self.digest_window = digest_window
 
     def __repr__(self):
         return "<%s name=%r webhook_url=%r>" % (self.__class__.__name__, self.name, self.webhook_url)
@@ -122,17 +155,214 @@ class ConfigGuild:
 class Config:
     def __init__(self, **kwargs):
         guilds = kwargs.get("guilds", [])
+        worlds = kwargs.get("worlds", [])
         self.webhook_url = kwargs.get("webhook_url")
         self.interval = int(kwargs.get("interval", 300))
+        self.discovery_interval = int(kwargs.get("discovery_interval", 3600))
+        self.guild_budget = int(kwargs.get("guild_budget", 60))
+        self.level_milestone_step = int(kwargs.get("level_milestone_step", 100))
+        self.level_milestone_min = int(kwargs.get("level_milestone_min", 100))
+        self.vocation_promotions = bool(kwargs.get("vocation_promotions", True))
+        self.sinks = [dict(sink) for sink in kwargs.get("sinks", [])]
+        self.digest_window = int(kwargs.get("digest_window", 0))
         self.guilds = []
         for guild in guilds:
             if isinstance(guild, str):
-                self.guilds.append(ConfigGuild(guild, self.webhook_url))
+                self.guilds.append(ConfigGuild(guild, self.webhook_url, self.digest_window))
             if isinstance(guild, dict):
-                self.guilds.append(ConfigGuild(guild["name"], guild["webhook_url"]))
+                self.guilds.append(ConfigGuild(guild["name"], guild["webhook_url"],
+                                               int(guild.get("digest_window", self.digest_window))))
+        self.worlds = []
+        for world in worlds:
+            if isinstance(world, str):
+                self.worlds.append(ConfigWorld(world, self.webhook_url, self.digest_window))
+            if isinstance(world, dict):
+                self.worlds.append(ConfigWorld(world["name"], world.get("webhook_url", self.webhook_url),
+                                               int(world.get("digest_window", self.digest_window))))
+
+    def __repr__(self):
+        return "<%s webhook_url=%r guilds=%r worlds=%r>" % (self.__class__.__name__, self.webhook_url, self.guilds,
+                                                           self.worlds)
+
+
+class RosterMember:
+    """
+    A compact, slotted representation of a guild member.
+
+    It only keeps the attributes of :class:`tibiapy.models.GuildMember`, without the overhead of a pydantic model.
+
+    :ivar name: The name of the character.
+    :ivar rank: The rank of the member. The string is interned, as it is shared by many members.
+    :ivar title: The title of the member, if any.
+    :ivar level: The level of the character.
+    :ivar vocation: The vocation of the character.
+    :ivar joined_on: The date when the member joined the guild.
+    :ivar is_online: Whether the member is online or not.
+    :ivar peak_level: The highest level seen for the character since the process started.
+    :type name: str
+    :type rank: str
+    :type title: Optional[str]
+    :type level: int
+    :type vocation: tibiapy.Vocation
+    :type joined_on: datetime.date
+    :type is_online: bool
+    :type peak_level: int
+    """
+    __slots__ = ("name", "rank", "title", "level", "vocation", "joined_on", "is_online", "peak_level")
+
+    def __init__(self, name, rank, title, level, vocation, joined_on, is_online=False, peak_level=None):
+        self.name = name
+        self.rank = sys.intern(rank)
+        self.title = title
+        self.level = level
+        self.vocation = vocation
+        self.joined_on = joined_on
+        self.is_online = is_online
+        self.peak_level = level if peak_level is None else peak_level
+
+    def __eq__(self, other):
+        """Two members are considered equal if their names are equal, like :class:`tibiapy.models.GuildMember`."""
+        if isinstance(other, self.__class__):
+            return self.name.lower() == other.name.lower()
+        return False
+
+    def __hash__(self):
+        return hash(self.name.lower())
 
     def __repr__(self):
-        return "<%s webhook_url=%r guilds=%r>" % (self.__class__.__name__, self.webhook_url, self.guilds)
+        return "<%s name=%r rank=%r level=%r>" % (self.__class__.__name__, self.name, self.rank, self.level)
+
+    @property
+    def url(self):
+        """:class:`str`: The URL of the character's information page on Tibia.com."""
+        return get_character_url(self.name)
+
+    @classmethod
+    def from_member(cls, member):
+        """Creates a compact member from a :class:`tibiapy.models.GuildMember`."""
+        return cls(member.name, member.rank, member.title, member.level, member.vocation, member.joined_on,
+                   member.is_online)
+
+    def to_member(self):
+        """Converts the compact member back to a :class:`tibiapy.models.GuildMember`."""
+        return GuildMember(name=self.name, rank=self.rank, title=self.title, level=self.level,
+                           vocation=self.vocation, joined_on=self.joined_on, is_online=self.is_online)
+
+
+class RosterInvite:
+    """
+    A compact, slotted representation of a guild invite.
+
+    :ivar name: The name of the character.
+    :ivar invited_on: The date when the character was invited.
+    :type name: str
+    :type invited_on: datetime.date
+    """
+    __slots__ = ("name", "invited_on")
+
+    def __init__(self, name, invited_on):
+        self.name = name
+        self.invited_on = invited_on
+
+    def __eq__(self, other):
+        if isinstance(other, self.__class__):
+            return self.name.lower() == other.name.lower()
+        return False
+
+    def __hash__(self):
+        return hash(self.name.lower())
+
+    def __repr__(self):
+        return "<%s name=%r invited_on=%r>" % (self.__class__.__name__, self.name, self.invited_on)
+
+    @property
+    def url(self):
+        """:class:`str`: The URL of the character's information page on Tibia.com."""
+        return get_character_url(self.name)
+
+    @classmethod
+    def from_invite(cls, invite):
+        """Creates a compact invite from a :class:`tibiapy.models.GuildInvite`."""
+        return cls(invite.name, invite.invited_on)
+
+    def to_invite(self):
+        """Converts the compact invite back to a :class:`tibiapy.models.GuildInvite`."""
+        return GuildInvite(name=self.name, invited_on=self.invited_on)
+
+
+class GuildRoster:
+    """
+    A compact representation of a guild, used to keep many guilds in memory.
+
+    It contains the same information as :class:`tibiapy.models.Guild`, so it can be converted back and forth without
+    losing data, and it can be used directly with :func:`compare_guild`.
+
+    Members that left the guild but couldn't be looked up yet are kept in ``deferred``, apart from the members, so
+    they are checked again on the next comparison. They are not part of the guild, so they are not saved.
+    """
+    __slots__ = ("name", "logo_url", "description", "world", "founded", "active", "guildhall", "open_applications",
+                 "active_war", "disband_date", "disband_condition", "homepage", "members", "invites", "deferred")
+
+    def __init__(self, name, world, logo_url, founded, active, members=(), invites=(), **kwargs):
+        self.name = name
+        self.world = world
+        self.logo_url = logo_url
+        self.founded = founded
+        self.active = active
+        self.description = kwargs.get("description")
+        self.guildhall = kwargs.get("guildhall")
+        self.open_applications = kwargs.get("open_applications", False)
+        self.active_war = kwargs.get("active_war", False)
+        self.disband_date = kwargs.get("disband_date")
+        self.disband_condition = kwargs.get("disband_condition")
+        self.homepage = kwargs.get("homepage")
+        self.members = list(members)
+        self.invites = list(invites)
+        self.deferred = list(kwargs.get("deferred", ()))
+
+    def __repr__(self):
+        return "<%s name=%r world=%r member_count=%d>" % (self.__class__.__name__, self.name, self.world,
+                                                         self.member_count)
+
+    @property
+    def member_count(self):
+        """:class:`int`: The number of members in the guild."""
+        return len(self.members)
+
+    @property
+    def ranks(self):
+        """:class:`list` of :class:`str`: Ranks in their hierarchical order."""
+        return list(dict.fromkeys(m.rank for m in self.members))
+
+    @classmethod
+    def from_guild(cls, guild):
+        """
+        Creates a compact roster from a guild.
+
+        :param guild: The guild to convert.
+        :type guild: tibiapy.models.Guild
+        :rtype: GuildRoster
+        """
+        return cls(guild.name, guild.world, guild.logo_url, guild.founded, guild.active,
+                   [RosterMember.from_member(m) for m in guild.members],
+                   [RosterInvite.from_invite(i) for i in guild.invites],
+                   description=guild.description, guildhall=guild.guildhall,
+                   open_applications=guild.open_applications, active_war=guild.active_war,
+                   disband_date=guild.disband_date, disband_condition=guild.disband_condition,
+                   homepage=guild.homepage)
+
+    def to_guild(self):
+        """
+        Converts the roster back to a guild.
+
+        :rtype: tibiapy.models.Guild
+        """
+        return Guild(name=self.name, world=self.world, logo_url=self.logo_url, founded=self.founded,
+                     active=self.active, description=self.description, guildhall=self.guildhall,
+                     open_applications=self.open_applications, active_war=self.active_war,
+                     disband_date=self.disband_date, disband_condition=self.disband_condition,
+                     homepage=self.homepage, members=[m.to_member() for m in self.members],
+                     invites=[i.to_invite() for i in self.invites])
 
 
 def load_config():
@@ -148,40 +378,439 @@ def load_config():
     exit()
 
 
-def save_data(file, data: Guild):
+def dump_data(data):
+    """
+    Converts data into the JSON content saved to data files.
+
+    Rosters are only converted to a full guild here, so the full guild is never kept in memory.
+
+    :param data: The guild's data, or a world's guild list.
+    :type data: tibiapy.Guild or GuildRoster or tibiapy.GuildsSection
+    :rtype: str
+    """
+    if isinstance(data, GuildRoster):
+        data = data.to_guild()
+    return data.model_dump_json(indent=1, by_alias=True)
+
+
+def save_data(file, data):
     """
     Saves a guild's data to a file.
     :param file: The file's path to save to
-    :param data: The guild's data.
+    :param data: The guild's data, or a world's guild list.
+    :type data: tibiapy.Guild or GuildRoster or tibiapy.GuildsSection
     """
     os.makedirs("data", exist_ok=True)
-    with open(os.path.join("data", file), "w", encoding="utf-8") as f:
-        f.write(data.model_dump_json(indent=1, by_alias=True))
+    content = dump_data(data)
+    path = os.path.join("data", file)
+    # Written to a temporary file first, so a crash never leaves a partially written file behind.
+    with open(path + ".tmp", "w", encoding="utf-8") as f:
+        f.write(content)
+    os.replace(path + ".tmp", path)
 
 
-def load_data(file):
+def load_data(file, model=Guild):
     """
     Loads guild data from a file.
     :param file: The file path to look for.
+    :param model: The model the data is stored as.
     :return: The guild's data, if available.
     :rtype: tibiapy.Guild
     """
     try:
         with open(os.path.join("data", file), "r", encoding="utf-8") as f:
-            return Guild.model_validate_json(f.read())
+            return model.model_validate_json(f.read())
     except (ValueError, FileNotFoundError):
         return None
 
 
-def get_character(name, tries=5):    # pragma: no cover
+def data_digest(data):
+    """
+    Gets the digest of the data, as it would be saved by :func:`save_data`.
+
+    :param data: The guild's data, or a world's guild list.
+    :type data: tibiapy.Guild or GuildRoster or tibiapy.GuildsSection
+    :rtype: str
+    """
+    return hashlib.sha1(dump_data(data).encode("utf-8")).hexdigest()
+
+
+def file_digest(file):
+    """
+    Gets the digest of a saved data file.
+
+    :param file: The file path to look for.
+    :return: The digest of the file's content, or :obj:`None` if the file doesn't exist.
+    :rtype: str
+    """
+    try:
+        with open(os.path.join("data", file), "rb") as f:
+            return hashlib.sha1(f.read()).hexdigest()
+    except FileNotFoundError:
+        return None
+
+
+# Times a notification is attempted to be delivered before giving up, per run.
+OUTBOX_MAX_ATTEMPTS = 50
+# HTTP client error statuses that are worth retrying, any other client error means the message will never be accepted.
+RETRYABLE_STATUSES = (408, 429)
+
+
+class Outbox:
+    """
+    An append-only log of notifications pending delivery.
+
+    Changes found during a cycle are added along with the data that produced them. When the outbox is committed, the
+    entries are written and synced to disk in a single operation, and only then the data files are saved and the
+    messages delivered. Every entry records the digest of the data file before and after the change, so data files
+    are never advanced without their notifications being durable, and an entry is only discarded if its data file
+    was never advanced past it.
+
+    Every entry is identified by a key derived from the data, and every message of the entry is acknowledged once
+    delivered, so entries left pending by a crash or a failed delivery are redelivered at least once, skipping
+    messages already delivered. Entries rejected by the webhook, or that failed too many times, are given up.
+
+    :ivar path: The path to the outbox file.
+    :ivar pending: The entries pending delivery, by key.
+    :type path: str
+    :type pending: dict of str, dict
+    """
+    def __init__(self, path=os.path.join("data", "outbox.ndjson")):
+        self.path = path
+        self.pending = {}
+        self._new_entries = []
+        self._snapshots = []
+        self._attempts = collections.Counter()
+
+    def __repr__(self):
+        return "<%s path=%r pending=%d>" % (self.__class__.__name__, self.path, len(self.pending))
+
+    def add(self, file, data, url, messages):
+        """
+        Adds the messages resulting from new data to the outbox.
+
+        The data file is not saved until the outbox is committed.
+
+        :param file: The data file the data will be saved to.
+        :param data: The data that produced the messages.
+        :param url: The webhook's URL.
+        :param messages: The message bodies to post, as returned by :func:`build_messages`.
+        :type file: str
+        :type data: GuildRoster or tibiapy.GuildsSection
+        :type url: str
+        :type messages: list of dict
+        """
+        digest = data_digest(data)
+        key = hashlib.sha1(f"{file}:{digest}".encode("utf-8")).hexdigest()[:16]
+        self._snapshots.append((file, data))
+        self._add_entry({"key": key, "file": file, "base": file_digest(file), "digest": digest, "url": url,
+                         "messages": messages, "sent": []})
+
+    def add_messages(self, key, url, messages):
+        """
+        Adds messages that are not related to any data file to the outbox.
+
+        :param key: A key identifying the messages, used to avoid adding them twice.
+        :param url: The webhook's URL.
+        :param messages: The message bodies to post, as returned by :func:`build_messages`.
+        :type key: str
+        :type url: str
+        :type messages: list of dict
+        """
+        self._add_entry({"key": key, "file": None, "base": None, "digest": None, "url": url, "messages": messages,
+                         "sent": []})
+
+    def defer(self, file, data):
+        """
+        Saves data once the outbox is committed, without any message.
+
+        :param file: The data file the data will be saved to.
+        :param data: The data to save.
+        :type file: str
+        :type data: GuildRoster or tibiapy.GuildsSection
+        """
+        self._snapshots.append((file, data))
+
+    def write(self):
+        """Writes and syncs the new entries to the outbox file."""
+        if self._new_entries:
+            self._append(self._new_entries, sync=True)
+            self._new_entries = []
+
+    def commit(self):
+        """Writes and syncs the new entries, saves their data files and delivers all pending messages."""
+        self.write()
+        for file, data in self._snapshots:
+            save_data(file, data)
+        self._snapshots = []
+        self.deliver()
+
+    def deliver(self):
+        """
+        Delivers all pending messages, acknowledging every message that was posted successfully.
+
+        Entries rejected by the webhook, or that failed :data:`OUTBOX_MAX_ATTEMPTS` times, are discarded. Once an entry
+        fails, later entries for the same webhook are not attempted, so messages are always posted in order.
+        """
+        finished = False
+        failed_urls = set()
+        for key, entry in list(self.pending.items()):
+            if entry["url"] in failed_urls:
+                continue
+            if not self._deliver_entry(key, entry):
+                failed_urls.add(entry["url"])
+                continue
+            del self.pending[key]
+            self._attempts.pop(key, None)
+            finished = True
+        if not self.pending:
+            if os.path.exists(self.path):
+                os.truncate(self.path, 0)
+        elif finished:
+            # Finished entries are removed, so the file doesn't keep growing while other entries keep failing.
+            self._rewrite()
+
+    def recover(self):
+        """
+        Loads the outbox file, redelivering pending entries whose data file was saved.
+
+        Entries whose data file is still in the state previous to the change are discarded, as the data was never
+        saved and the same changes will be found again on the next scan. If the data file was saved again later, the
+        entry is still delivered.
+        """
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                lines = f.readlines()
+        except FileNotFoundError:
+            return
+        for line in lines:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                # The last line may be incomplete if the process died while writing it.
+                continue
+            if "ack" in record:
+                entry = self.pending.get(record["ack"])
+                if entry is not None and record["index"] not in entry["sent"]:
+                    entry["sent"].append(record["index"])
+            else:
+                self.pending[record["key"]] = record
+        for key, entry in list(self.pending.items()):
+            if entry["file"] is not None and file_digest(entry["file"]) == entry["base"]:
+                log.info(f"Discarding notifications for {entry['file']}, data was not saved.")
+                del self.pending[key]
+        if self.pending:
+            log.info(f"Redelivering {len(self.pending)} pending notifications.")
+        self._rewrite()
+        self.deliver()
+
+    def _deliver_entry(self, key, entry):
+        """Delivers the pending messages of an entry, returning whether the entry is finished."""
+        for i, body in enumerate(entry["messages"]):
+            if i in entry["sent"]:
+                continue
+            try:
+                posted = post_message(entry["url"], body)
+            except WebhookRejected as e:
+                log.error(f"Giving up notification {key}: {e}")
+                return True
+            if not posted:
+                self._attempts[key] += 1
+                if self._attempts[key] < OUTBOX_MAX_ATTEMPTS:
+                    return False
+                log.error(f"Giving up notification {key} after {self._attempts[key]} attempts.")
+                return True
+            entry["sent"].append(i)
+            self._append([{"ack": key, "index": i}])
+        return True
+
+    def _add_entry(self, entry):
+        if entry["key"] in self.pending:
+            return
+        self.pending[entry["key"]] = entry
+        self._new_entries.append(entry)
+
+    def _append(self, records, sync=False):
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write("".join(json.dumps(r, default=str) + "\n" for r in records))
+            if sync:
+                f.flush()
+                os.fsync(f.fileno())
+
+    def _rewrite(self):
+        """Rewrites the outbox file with only the pending entries."""
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        with open(self.path + ".tmp", "w", encoding="utf-8") as f:
+            f.write("".join(json.dumps(e, default=str) + "\n" for e in self.pending.values()))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(self.path + ".tmp", self.path)
+
+
+class WebhookRejected(Exception):
+    """Raised when a webhook rejects a message for a reason that retrying won't solve."""
+    pass
+
+
+class DeadlineExceeded(Exception):
+    """Raised when an operation can't be completed before its deadline."""
+    pass
+
+
+class FetchError(Exception):
+    """Raised when information couldn't be fetched from Tibia.com after all retries."""
+    pass
+
+
+class CircuitBreaker:
+    """
+    Keeps track of targets that keep failing, so they are not requested every cycle.
+
+    Every failure puts the target in a cool-down that doubles with each consecutive failure. Targets that don't exist
+    have a longer cool-down than targets that failed due to a transient error. The state is persisted, so it
+    survives restarts.
+
+    :ivar path: The path to the file where the state is saved.
+    :ivar error_cooldown: The initial cool-down in seconds after a transient error.
+    :ivar missing_cooldown: The initial cool-down in seconds after a target was not found.
+    :ivar max_cooldown: The maximum cool-down in seconds.
+    :ivar states: The state of every failing target, by key.
+    :type path: str
+    :type error_cooldown: int
+    :type missing_cooldown: int
+    :type max_cooldown: int
+    :type states: dict of str, dict
+    """
+    def __init__(self, path=os.path.join("data", "breakers.json"), error_cooldown=60, missing_cooldown=3600,
+                 max_cooldown=86400):
+        self.path = path
+        self.error_cooldown = error_cooldown
+        self.missing_cooldown = missing_cooldown
+        self.max_cooldown = max_cooldown
+        self.states = {}
+
+    def __repr__(self):
+        return "<%s path=%r states=%d>" % (self.__class__.__name__, self.path, len(self.states))
+
+    def allow(self, key, now=None):
+        """
+        Checks if a target can be requested.
+
+        :param key: The target's key.
+        :param now: The current timestamp.
+        :return: Whether the target is not in cool-down or not.
+        :rtype: bool
+        """
+        state = self.states.get(key)
+        return state is None or (now or time.time()) >= state["until"]
+
+    def is_missing(self, key):
+        """
+        Checks if a target is known to not exist.
+
+        :param key: The target's key.
+        :rtype: bool
+        """
+        state = self.states.get(key)
+        return state is not None and state["reason"] == "missing"
+
+    def failures(self, key):
+        """
+        Gets the number of consecutive failures of a target.
+
+        :param key: The target's key.
+        :rtype: int
+        """
+        state = self.states.get(key)
+        return state["failures"] if state is not None else 0
+
+    def record_success(self, key):
+        """Records a successful request, closing the target's circuit."""
+        self.states.pop(key, None)
+
+    def record_failure(self, key, missing, now=None):
+        """
+        Records a failed request, putting the target in cool-down.
+
+        :param key: The target's key.
+        :param missing: Whether the target doesn't exist, or a transient error occurred.
+        :param now: The current timestamp.
+        :type key: str
+        :type missing: bool
+        :type now: float
+        """
+        now = now or time.time()
+        reason = "missing" if missing else "error"
+        state = self.states.get(key)
+        failures = state["failures"] + 1 if state and state["reason"] == reason else 1
+        cooldown = self.missing_cooldown if missing else self.error_cooldown
+        cooldown = min(cooldown * 2 ** (failures - 1), self.max_cooldown)
+        self.states[key] = {"reason": reason, "failures": failures, "until": now + cooldown}
+        log.warning(f"{key} - Failed {failures} times ({reason}), waiting {cooldown} seconds.")
+
+    def report(self, now=None):
+        """
+        Gets the targets currently in cool-down.
+
+        :rtype: dict of str, dict
+        """
+        now = now or time.time()
+        return {k: v for k, v in self.states.items() if v["until"] > now}
+
+    def load(self):
+        """Loads the saved state."""
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                self.states = json.load(f)
+        except (ValueError, FileNotFoundError):
+            self.states = {}
+
+    def save(self, now=None):
+        """Saves the state, forgetting targets whose cool-down ended long ago."""
+        now = now or time.time()
+        self.states = {k: v for k, v in self.states.items() if now - v["until"] < self.max_cooldown}
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        with open(self.path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump(self.states, f, indent=1)
+        os.replace(self.path + ".tmp", self.path)
+
+
+# Times looking up a removed member can fail before they are reported as removed, instead of checking them again.
+MEMBER_MAX_FAILURES = 5
+
+
+def get_timeout(deadline):
+    """
+    Gets the time left before a deadline, to be used as a request's timeout.
+
+    :param deadline: The deadline, as a :func:`time.monotonic` value, or :obj:`None` if there's no deadline.
+    :type deadline: float
+    :return: The seconds left, or :obj:`None` if there's no deadline.
+    :rtype: float
+    :raises DeadlineExceeded: If the deadline already passed.
+    """
+    if deadline is None:
+        return None
+    remaining = deadline - time.monotonic()
+    if remaining <= 0:
+        raise DeadlineExceeded()
+    return remaining
+
+
+def get_character(name, tries=5, deadline=None):    # pragma: no cover
     """
     Gets information about a character from Tibia.com
     :param name: The name of the character.
     :param tries: The maximum amount of retries before giving up.
+    :param deadline: The time limit for the request and its retries, as a :func:`time.monotonic` value.
     :return: The character's information
     :type name: str
     :type tries: int
+    :type deadline: float
     :rtype: tibiapy.Character
+    :raises DeadlineExceeded: If the deadline passed before the character could be fetched.
+    :raises FetchError: If the character couldn't be fetched after all retries.
     """
     try:
         url = get_character_url(name)
@@ -190,36 +819,75 @@ def get_character(name, tries=5):    # pragma: no cover
 
     # Fetch website
     try:
-        r = requests.get(url=url)
+        r = requests.get(url=url, timeout=get_timeout(deadline))
         content = r.text
-    except requests.RequestException:
+    except requests.RequestException as e:
         if tries == 0:
-            return None
+            raise FetchError() from e
         tries -= 1
-        return get_character(name, tries)
-    return CharacterParser.from_content(content)
+        return get_character(name, tries, deadline)
+    try:
+        return CharacterParser.from_content(content)
+    except tibiapy.errors.InvalidContentError as e:
+        raise FetchError() from e
 
 
-def get_guild(name, tries=5):    # pragma: no cover
+def get_guild(name, tries=5, deadline=None):    # pragma: no cover
     """
     Gets information about a guild from Tibia.com
     :param name: The name of the guild. Case sensitive.
     :param tries: The maximum amount of retries before giving up.
+    :param deadline: The time limit for the request and its retries, as a :func:`time.monotonic` value.
     :return: The guild's information
     :type name: str
     :type tries: int
+    :type deadline: float
     :rtype: tibiapy.Guild
+    :raises DeadlineExceeded: If the deadline passed before the guild could be fetched.
+    :raises FetchError: If the guild couldn't be fetched after all retries.
     """
     try:
-        r = requests.get(get_guild_url (name))
+        r = requests.get(get_guild_url(name), timeout=get_timeout(deadline))
         content = r.text
-    except requests.RequestException:
+    except requests.RequestException as e:
         if tries == 0:
-            return None
+            raise FetchError() from e
         tries -= 1
-        return get_guild(name, tries)
+        return get_guild(name, tries, deadline)
 
-    return GuildParser.from_content(content)
+    try:
+        return GuildParser.from_content(content)
+    except tibiapy.errors.InvalidContentError as e:
+        raise FetchError() from e
+
+
+def get_world_guilds(world, tries=5, deadline=None):    # pragma: no cover
+    """
+    Gets the list of guilds of a world from Tibia.com
+    :param world: The name of the world.
+    :param tries: The maximum amount of retries before giving up.
+    :param deadline: The time limit for the request and its retries, as a :func:`time.monotonic` value.
+    :return: The world's guild list.
+    :type world: str
+    :type tries: int
+    :type deadline: float
+    :rtype: tibiapy.GuildsSection
+    :raises DeadlineExceeded: If the deadline passed before the list could be fetched.
+    :raises FetchError: If the list couldn't be fetched after all retries.
+    """
+    try:
+        r = requests.get(get_world_guilds_url(world), timeout=get_timeout(deadline))
+        content = r.text
+    except requests.RequestException as e:
+        if tries == 0:
+            raise FetchError() from e
+        tries -= 1
+        return get_world_guilds(world, tries, deadline)
+
+    try:
+        return GuildsSectionParser.from_content(content)
+    except tibiapy.errors.InvalidContentError as e:
+        raise FetchError() from e
 
 
 def split_message(message):  # pragma: no cover
@@ -246,23 +914,38 @@ def split_message(message):  # pragma: no cover
         return message_list
 
 
-def compare_guild(before, after):
+def compare_guild(before, after, joins=None, deadline=None, breaker=None, deferred=None):
     """
     Compares the same guild at different points in time, to obtain the changes made.
 
     It returns all the changes found.
 
+    Both guilds can be either :class:`tibiapy.Guild` or :class:`GuildRoster`, as long as they are of the same type.
+
     :param before: The state of the guild in the previous saved state.
-    :type before: tibiapy.Guild
+    :type before: tibiapy.Guild or GuildRoster
     :param after:  The current state of the guild.
-    :type after: tibiapy.Guild
+    :type after: tibiapy.Guild or GuildRoster
+    :param joins: The recent joins to other watched guilds, used to detect members that moved between them.
+    :type joins: JoinIndex
+    :param deadline: The time limit for looking up removed members, as a :func:`time.monotonic` value.
+    :type deadline: float
+    :param breaker: The circuit breaker keeping track of characters that don't exist or keep failing.
+    :type breaker: CircuitBreaker
+    :param deferred: A list where removed members that couldn't be looked up are added. If ``after`` is a
+        :class:`GuildRoster`, these members are also kept in its ``deferred`` list, so they are checked again when it
+        is compared on the next scan.
+    :type deferred: list
     :return: A list of all the changes found.
     :rtype: list of Change
+    :raises DeadlineExceeded: If the removed members couldn't be looked up before the deadline.
     """
     changes = []
     # Members no longer in guild. Some may have changed name.
-    removed_members = [m for m in before.members if m not in after.members]
-    joined = [m for m in after.members if m not in before.members]
+    # Members that couldn't be looked up on the previous scan are checked again.
+    previous_members = before.members + getattr(before, "deferred", [])
+    removed_members = [m for m in previous_members if m not in after.members]
+    joined = [m for m in after.members if m not in previous_members]
 
     if before.guildhall != after.guildhall:
         if before.guildhall is None:
@@ -283,7 +966,14 @@ def compare_guild(before, after):
         log.info("Guild application status changed: %s", "open" if after.open_applications else "closed")
 
     compare_members(after, before, changes)
-    check_removed_members(changes, joined, removed_members)
+    deferred_members = []
+    check_removed_members(changes, joined, removed_members, after.name, joins, deadline, breaker, deferred_members,
+                          after.members)
+    if isinstance(after, GuildRoster):
+        # Kept apart from the members, so they are not published or saved, but are checked again on the next scan.
+        after.deferred = deferred_members
+    if deferred is not None:
+        deferred.extend(deferred_members)
 
     changes += [Change(ChangeType.NEW_MEMBER, m) for m in joined]
     if len(joined) > 0:
@@ -308,11 +998,11 @@ def compare_members(after, before, changes):
                 try:
                     # Check if new rank position's is higher or lower
                     if ranks.index(member.rank) < ranks.index(member_after.rank):
-                        changes.append(Change(ChangeType.DEMOTED, member_after))
+                        changes.append(Change(ChangeType.DEMOTED, member_after, member.rank))
                         log.info("Member demoted: %s" % member_after.name)
                     else:
                         log.info("Member promoted: %s" % member_after.name)
-                        changes.append(Change(ChangeType.PROMOTED, member_after))
+                        changes.append(Change(ChangeType.PROMOTED, member_after, member.rank))
                 except ValueError:
                     # The member used to have a rank that no longer exists:
                     # This can be due to the rank being renamed or the rank being no longer visible as it has no members
@@ -324,12 +1014,50 @@ def compare_members(after, before, changes):
             break
 
 
-def check_removed_members(changes, joined, removed_members):
-    """Checks every removed member to see if they left, changed name or were deleted."""
+def check_removed_members(changes, joined, removed_members, guild_name=None, joins=None, deadline=None,
+                          breaker=None, deferred=None, members=None):
+    """Checks every removed member to see if they left, changed name, were deleted or moved to another guild.
+
+    Members whose lookup keeps failing are added to ``deferred``, until they failed :data:`MEMBER_MAX_FAILURES` times,
+    after which they are reported as removed. If ``members`` is given, renames are also matched against all the current
+    members, as a member renamed while their lookup was failing was already announced as a new member."""
     for member in removed_members:
+        # Members that joined another watched guild don't need to be looked up.
+        new_guild = joins.find(member.name, guild_name) if joins is not None else None
+        if new_guild is not None:
+            log.info("Member moved to %s: %s" % (new_guild, member.name))
+            changes.append(Change(ChangeType.MOVED, member, new_guild))
+            continue
         # We check if it was a namechange or character deleted
-        log.info("Checking character {0.name}".format(member))
-        char = get_character(member.name)
+        key = f"character:{member.name}"
+        if breaker is not None and breaker.is_missing(key) and not breaker.allow(key):
+            log.info("Member deleted: %s" % member.name)
+            changes.append(Change(ChangeType.DELETED, member))
+            continue
+        char = None
+        failed = breaker is not None and not breaker.allow(key)
+        if not failed:
+            log.info("Checking character {0.name}".format(member))
+            try:
+                char = get_character(member.name, deadline=deadline)
+            except FetchError:
+                if breaker is not None:
+                    breaker.record_failure(key, False)
+                failed = True
+        if failed:
+            if breaker is not None and deferred is not None and breaker.failures(key) < MEMBER_MAX_FAILURES:
+                log.warning(f"Couldn't check character {member.name}, checking again on the next scan.")
+                deferred.append(member)
+                continue
+            # They are no longer in the guild, even if it's unknown if they were renamed or deleted.
+            log.info("Member no longer in guild: " + member.name)
+            changes.append(Change(ChangeType.REMOVED, member))
+            continue
+        if breaker is not None:
+            if char is None:
+                breaker.record_failure(key, True)
+            else:
+                breaker.record_success(key)
         # Character was deleted (or maybe namelocked)
         if char is None:
             log.info("Member deleted: %s" % member.name)
@@ -344,11 +1072,70 @@ def check_removed_members(changes, joined, removed_members):
                 log.info("%s changed name to %s" % (member.name, _member.name))
                 found = True
                 break
+        if not found and members is not None:
+            for _member in members:
+                if char.name == _member.name:
+                    changes.append(Change(ChangeType.NAME_CHANGE, _member, member.name))
+                    log.info("%s changed name to %s" % (member.name, _member.name))
+                    found = True
+                    break
         if not found:
             log.info("Member no longer in guild: " + member.name)
             changes.append(Change(ChangeType.REMOVED, member))
 
 
+class JoinIndex:
+    """
+    An index of the characters that recently joined any of the watched guilds.
+
+    Guilds are scanned one after another, so a character could leave a guild after it was scanned and join another one
+    before it is scanned. To reconcile these, joins are kept for a number of cycles.
+
+    :ivar cycles: The number of cycles joins are kept for.
+    :type cycles: int
+    """
+    def __init__(self, cycles=2):
+        self.cycles = cycles
+        self.cycle = 0
+        self._joins = {}
+
+    def __repr__(self):
+        return "<%s cycle=%d joins=%d>" % (self.__class__.__name__, self.cycle, len(self._joins))
+
+    def add_guild(self, before, after):
+        """
+        Adds the members that joined a guild between two states.
+
+        :param before: The previous state of the guild.
+        :param after: The current state of the guild.
+        :type before: GuildRoster
+        :type after: GuildRoster
+        """
+        previous = {m.name.lower() for m in before.members}
+        for member in after.members:
+            if member.name.lower() not in previous:
+                self._joins[member.name.lower()] = (after.name, self.cycle)
+
+    def find(self, name, guild_name=None):
+        """
+        Finds the guild a character recently joined.
+
+        :param name: The name of the character.
+        :param guild_name: The guild the character left, joins to this guild are ignored.
+        :return: The name of the guild joined, or :obj:`None` if the character didn't join any watched guild.
+        :rtype: str
+        """
+        entry = self._joins.get(name.lower())
+        if entry is None or entry[0] == guild_name:
+            return None
+        return entry[0]
+
+    def next_cycle(self):
+        """Starts a new cycle, forgetting the joins that are too old."""
+        self.cycle += 1
+        self._joins = {k: v for k, v in self._joins.items() if self.cycle - v[1] < self.cycles}
+
+
 def compare_guild_invites(after, before, changes, joined):
     """Compares invites, to see if they were accepted or rejected."""
     new_invites = [i for i in after.invites if i not in before.invites]
@@ -368,6 +1155,643 @@ def compare_guild_invites(after, before, changes, joined):
         log.info("New invites found: " + ",".join(m.name for m in new_invites))
 
 
+# Version of the event schema. Only incremented when existing fields are changed or removed.
+EVENT_SCHEMA_VERSION = 1
+# Attributes of a change's member that are included in events, if present.
+EVENT_MEMBER_FIELDS = ("name", "rank", "title", "level", "vocation", "joined_on", "invited_on")
+
+
+def serialize_value(value):
+    """Converts a value into a JSON serializable value."""
+    if isinstance(value, Enum):
+        return value.value
+    if isinstance(value, (datetime.date, datetime.datetime)):
+        return value.isoformat()
+    if isinstance(value, (list, tuple)):
+        return [serialize_value(v) for v in value]
+    return value
+
+
+def serialize_change(change, guild=None, world=None, timestamp=None):
+    """
+    Converts a change into an event, a dictionary with a stable schema.
+
+    Events contain the following keys: ``version``, ``time``, ``type``, ``guild``, ``world``, ``member`` and
+    ``extra``. ``member`` contains the member's attributes that are available, and is :obj:`None` for changes not
+    related to a member. Dates are in ISO 8601 format, and vocations are their names.
+
+    :param change: The change to serialize.
+    :param guild: The name of the guild where the change happened.
+    :param world: The world where the change happened.
+    :param timestamp: The time when the change was found, as a timestamp.
+    :type change: Change
+    :type guild: str
+    :type world: str
+    :type timestamp: float
+    :rtype: dict
+    """
+    member = None
+    if change.member is not None:
+        member = {f: serialize_value(getattr(change.member, f)) for f in EVENT_MEMBER_FIELDS
+                  if hasattr(change.member, f)}
+    return {
+        "version": EVENT_SCHEMA_VERSION,
+        "time": datetime.datetime.fromtimestamp(time.time() if timestamp is None else timestamp,
+                                               datetime.timezone.utc).isoformat(),
+        "type": change.type.name,
+        "guild": guild,
+        "world": world,
+        "member": member,
+        "extra": serialize_value(change.extra),
+    }
+
+
+class EventSink:
+    """
+    Base class for event sinks, that receive every change found as a JSON line.
+
+    Events are buffered and written in batches. If the destination can't keep up or is unavailable, events are kept
+    and retried on the next flush, up to ``max_pending`` events, after which the oldest events are dropped.
+
+    :ivar batch_size: The number of events written at once.
+    :ivar max_pending: The maximum number of events kept while the destination is unavailable.
+    :ivar dropped: The number of events dropped so far.
+    :type batch_size: int
+    :type max_pending: int
+    :type dropped: int
+    """
+    def __init__(self, batch_size=100, max_pending=10000):
+        self.batch_size = batch_size
+        self.max_pending = max_pending
+        self.dropped = 0
+        self._pending = collections.deque()
+
+    def __repr__(self):
+        return "<%s pending=%d dropped=%d>" % (self.__class__.__name__, len(self._pending), self.dropped)
+
+    def emit(self, events):
+        """
+        Adds events to the sink, writing them if a batch is complete.
+
+        :param events: The events to add.
+        :type events: list of dict
+        """
+        for event in events:
+            self._pending.append(json.dumps(event) + "\n")
+        while len(self._pending) > self.max_pending:
+            self._pending.popleft()
+            self.dropped += 1
+        if len(self._pending) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        """Writes all pending events, until the destination stops accepting them."""
+        while self._pending:
+            batch = [self._pending[i] for i in range(min(self.batch_size, len(self._pending)))]
+            if not self.write("".join(batch)):
+                log.warning(f"{self!r} - Couldn't write events, retrying later.")
+                return
+            for _ in batch:
+                self._pending.popleft()
+
+    def write(self, data):
+        """
+        Writes a batch of events.
+
+        :param data: The events, as JSON lines.
+        :type data: str
+        :return: Whether the events were written or not.
+        :rtype: bool
+        """
+        raise NotImplementedError
+
+    def close(self):
+        """Flushes the pending events and releases any resource held."""
+        self.flush()
+
+
+class FileSink(EventSink):
+    """
+    Writes events to a NDJSON file, rotating it when it exceeds a size.
+
+    :ivar path: The path to the file.
+    :ivar max_bytes: The size at which the file is rotated.
+    :ivar backup_count: The number of rotated files kept, named ``path.1``, ``path.2`` and so on.
+    :type path: str
+    :type max_bytes: int
+    :type backup_count: int
+    """
+    def __init__(self, path, max_bytes=10 * 1024 * 1024, backup_count=5, **kwargs):
+        super().__init__(**kwargs)
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+
+    def write(self, data):
+        try:
+            if os.path.exists(self.path) and os.path.getsize(self.path) + len(data) > self.max_bytes:
+                self.rotate()
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(data)
+        except OSError:
+            return False
+        return True
+
+    def rotate(self):
+        """Rotates the file, discarding the oldest one."""
+        for i in range(self.backup_count - 1, 0, -1):
+            if os.path.exists(f"{self.path}.{i}"):
+                os.replace(f"{self.path}.{i}", f"{self.path}.{i + 1}")
+        if self.backup_count > 0:
+            os.replace(self.path, f"{self.path}.1")
+        else:
+            os.remove(self.path)
+
+
+class UnixSocketSink(EventSink):
+    """
+    Sends events to a local Unix socket, reconnecting when the connection is lost.
+
+    If the socket stops accepting data in the middle of a batch, the rest of the batch is sent before anything else,
+    so lines are never split or repeated. If the connection is lost instead, it may end with a partial line, which
+    consumers must discard. That line is sent again in full on the next connection.
+
+    :ivar path: The path to the socket.
+    :ivar timeout: The seconds to wait for the socket to accept data before retrying later.
+    :type path: str
+    :type timeout: float
+    """
+    def __init__(self, path, timeout=1, **kwargs):
+        super().__init__(**kwargs)
+        self.path = path
+        self.timeout = timeout
+        self._socket = None
+        self._unsent = b""
+        self._sent = 0
+
+    def write(self, data):
+        if not self._drain():
+            return False
+        self._unsent = data.encode("utf-8")
+        self._sent = 0
+        # The batch is taken even if only part of it is sent, the rest is sent first on the next attempt.
+        self._drain()
+        return True
+
+    def flush(self):
+        if self._sent < len(self._unsent) and not self._drain():
+            log.warning(f"{self!r} - Couldn't write events, retrying later.")
+            return
+        super().flush()
+
+    def close(self):
+        self.flush()
+        self._disconnect()
+
+    def _drain(self):
+        """Sends what is left of the last batch, returning whether everything was sent."""
+        try:
+            if self._socket is None:
+                self._socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+                self._socket.settimeout(self.timeout)
+                self._socket.connect(self.path)
+            while self._sent < len(self._unsent):
+                self._sent += self._socket.send(self._unsent[self._sent:])
+        except socket.timeout:
+            return False
+        except OSError:
+            # The line being sent is sent again in full, as consumers discard the partial line.
+            self._sent = self._unsent.rfind(b"\n", 0, self._sent) + 1
+            self._disconnect()
+            return False
+        self._unsent = b""
+        self._sent = 0
+        return True
+
+    def _disconnect(self):
+        if self._socket is not None:
+            self._socket.close()
+            self._socket = None
+
+
+class StdoutSink(EventSink):
+    """Writes events to the standard output."""
+    def write(self, data):
+        try:
+            sys.stdout.write(data)
+            sys.stdout.flush()
+        except OSError:
+            return False
+        return True
+
+
+SINK_TYPES = {
+    "file": FileSink,
+    "socket": UnixSocketSink,
+    "stdout": StdoutSink,
+}
+
+
+def create_sink(options):
+    """
+    Creates an event sink from its configuration.
+
+    :param options: The sink's configuration. ``type`` is the kind of sink, the rest are passed to the sink.
+    :type options: dict
+    :rtype: EventSink
+    :raises ValueError: If the sink's type is unknown.
+    """
+    options = dict(options)
+    sink_type = options.pop("type", None)
+    if sink_type not in SINK_TYPES:
+        raise ValueError(f"Unknown sink type: {sink_type}")
+    return SINK_TYPES[sink_type](**options)
+
+
+def emit_events(sinks, changes, guild=None, world=None):
+    """
+    Emits changes to every sink.
+
+    :param sinks: The sinks to emit to.
+    :param changes: The changes found.
+    :param guild: The name of the guild where the changes happened.
+    :param world: The world where the changes happened.
+    :type sinks: list of EventSink
+    :type changes: list of Change
+    :type guild: str
+    :type world: str
+    """
+    if not sinks or not changes:
+        return
+    timestamp = time.time()
+    events = [serialize_change(c, guild, world, timestamp) for c in changes]
+    for sink in sinks:
+        sink.emit(events)
+
+
+# Changes that cancel out an earlier change of the same member (or the guild) in the same digest.
+OFFSETTING_CHANGES = {
+    ChangeType.REMOVED: (ChangeType.NEW_MEMBER,),
+    ChangeType.DELETED: (ChangeType.NEW_MEMBER,),
+    ChangeType.MOVED: (ChangeType.NEW_MEMBER,),
+    ChangeType.NEW_MEMBER: (ChangeType.REMOVED, ChangeType.MOVED),
+    ChangeType.INVITE_REMOVED: (ChangeType.NEW_INVITE,),
+    ChangeType.NEW_INVITE: (ChangeType.INVITE_REMOVED,),
+    ChangeType.APPLICATIONS_CHANGE: (ChangeType.APPLICATIONS_CHANGE,),
+    ChangeType.NEW_DISBAND_WARNING: (ChangeType.REMOVED_DISBAND_WARNING,),
+    ChangeType.REMOVED_DISBAND_WARNING: (ChangeType.NEW_DISBAND_WARNING,),
+}
+
+
+def deserialize_change(event):
+    """
+    Converts an event created by :func:`serialize_change` back into a change.
+
+    :param event: The event to convert.
+    :type event: dict
+    :rtype: Change
+    """
+    change_type = ChangeType[event["type"]]
+    member = event["member"]
+    if member is not None:
+        if "invited_on" in member:
+            member = RosterInvite(member["name"], datetime.date.fromisoformat(member["invited_on"]))
+        else:
+            member = RosterMember(member["name"], member["rank"], member["title"], member["level"],
+                                  tibiapy.enums.Vocation(member["vocation"]),
+                                  datetime.date.fromisoformat(member["joined_on"]))
+    extra = event["extra"]
+    if change_type == ChangeType.VOCATION_PROMOTED:
+        extra = tibiapy.enums.Vocation(extra)
+    elif change_type == ChangeType.NEW_DISBAND_WARNING and extra is not None:
+        extra = (extra[0], datetime.date.fromisoformat(extra[1]) if extra[1] else None)
+    elif isinstance(extra, list):
+        extra = tuple(extra)
+    return Change(change_type, member, extra)
+
+
+def merge_changes(changes, new_changes, ranks=None):
+    """
+    Merges new changes into a list of changes, cancelling out changes that offset each other.
+
+    Members that joined and left, or invites that were sent and revoked are removed. Rank changes, title changes and
+    level milestones of the same member are collapsed into one, or removed if the member is back where they started.
+
+    :param changes: The changes found so far.
+    :type changes: list of Change
+    :param new_changes: The new changes found.
+    :type new_changes: list of Change
+    :param ranks: The current ranks of the guild, from highest to lowest, to find the net change of rank.
+    :type ranks: list of str
+    :return: The merged list of changes.
+    :rtype: list of Change
+    """
+    merged = list(changes)
+    for change in new_changes:
+        name = change.member.name.lower() if change.member is not None else None
+
+        def same(c):
+            return (c.member.name.lower() if c.member is not None else None) == name
+
+        offset = next((c for c in reversed(merged)
+                       if c.type in OFFSETTING_CHANGES.get(change.type, ()) and same(c)), None)
+        if offset is not None:
+            merged.remove(offset)
+            if offset.type == ChangeType.NEW_MEMBER:
+                # The member is gone, nothing else about them matters.
+                merged = [c for c in merged if not same(c)]
+            continue
+        if change.type in (ChangeType.TITLE_CHANGE, ChangeType.LEVEL_MILESTONE):
+            previous = next((c for c in merged if c.type == change.type and same(c)), None)
+            if previous is not None:
+                merged.remove(previous)
+                if change.type == ChangeType.TITLE_CHANGE:
+                    if change.member.title == previous.extra:
+                        continue
+                    change = Change(ChangeType.TITLE_CHANGE, change.member, previous.extra)
+        if change.type in (ChangeType.PROMOTED, ChangeType.DEMOTED):
+            previous = next((c for c in merged if c.type in (ChangeType.PROMOTED, ChangeType.DEMOTED) and same(c)),
+                            None)
+            if previous is not None:
+                merged.remove(previous)
+                # The rank the member had before the first change.
+                rank = previous.extra
+                if change.member.rank == rank:
+                    continue
+                change_type = change.type
+                # If the previous rank no longer exists, the direction of the last change is kept.
+                if ranks is not None and rank in ranks and change.member.rank in ranks:
+                    demoted = ranks.index(rank) < ranks.index(change.member.rank)
+                    change_type = ChangeType.DEMOTED if demoted else ChangeType.PROMOTED
+                change = Change(change_type, change.member, rank)
+        merged.append(change)
+    return merged
+
+
+class DigestEntry:
+    """
+    The changes of a guild buffered during a digest window.
+
+    :ivar url: The webhook's URL.
+    :ivar name: The name of the guild.
+    :ivar avatar: The URL to the guild's logo.
+    :ivar started: The time when the window started, as a timestamp.
+    :ivar window: The length of the window in seconds.
+    :ivar member_count_before: The number of members when the window started.
+    :ivar member_count: The current number of members.
+    :ivar changes: The changes buffered.
+    :type url: str
+    :type name: str
+    :type avatar: str
+    :type started: float
+    :type window: int
+    :type member_count_before: int
+    :type member_count: int
+    :type changes: list of Change
+    """
+    def __init__(self, url, name, avatar, started, window, member_count_before, member_count, changes=None):
+        self.url = url
+        self.name = name
+        self.avatar = avatar
+        self.started = started
+        self.window = window
+        self.member_count_before = member_count_before
+        self.member_count = member_count
+        self.changes = changes or []
+
+    def __repr__(self):
+        return "<%s name=%r url=%r changes=%d>" % (self.__class__.__name__, self.name, self.url, len(self.changes))
+
+    def to_dict(self):
+        return {
+            "url": self.url,
+            "name": self.name,
+            "avatar": self.avatar,
+            "started": self.started,
+            "window": self.window,
+            "member_count_before": self.member_count_before,
+            "member_count": self.member_count,
+            "changes": [serialize_change(c, self.name, timestamp=self.started) for c in self.changes],
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        data = dict(data)
+        data["changes"] = [deserialize_change(e) for e in data["changes"]]
+        return cls(**data)
+
+
+class Digest:
+    """
+    Buffers the changes of guilds over a window, to publish them as a single summary.
+
+    Buffered changes are saved to a file, so they survive restarts. The file must be saved before the data of the
+    guilds is saved, so changes are never lost.
+
+    :ivar path: The path to the file where the buffered changes are saved.
+    :ivar entries: The changes buffered for every webhook and guild.
+    :type path: str
+    :type entries: dict of str, DigestEntry
+    """
+    def __init__(self, path=os.path.join("data", "digest.json")):
+        self.path = path
+        self.entries = {}
+        self._dirty = False
+
+    def __repr__(self):
+        return "<%s path=%r entries=%d>" % (self.__class__.__name__, self.path, len(self.entries))
+
+    def add(self, url, name, avatar, window, changes, member_count_before, member_count, ranks=None, now=None):
+        """
+        Adds the changes of a guild to its digest, starting a new window if there's none.
+
+        :param url: The webhook's URL.
+        :param name: The name of the guild.
+        :param avatar: The URL to the guild's logo.
+        :param window: The length of the window in seconds.
+        :param changes: The changes found.
+        :param member_count_before: The number of members before the changes.
+        :param member_count: The number of members after the changes.
+        :param ranks: The current ranks of the guild, from highest to lowest.
+        :param now: The current timestamp.
+        """
+        key = f"{url}|{name}"
+        entry = self.entries.get(key)
+        if entry is None:
+            entry = DigestEntry(url, name, avatar, now or time.time(), window, member_count_before, member_count)
+            self.entries[key] = entry
+        entry.changes = merge_changes(entry.changes, changes, ranks)
+        entry.avatar = avatar
+        entry.member_count = member_count
+        self._dirty = True
+
+    def pop_due(self, now=None):
+        """
+        Removes and returns the entries whose window ended.
+
+        :param now: The current timestamp.
+        :rtype: list of DigestEntry
+        """
+        now = now or time.time()
+        due = [k for k, e in self.entries.items() if now >= e.started + e.window]
+        if due:
+            self._dirty = True
+        return [self.entries.pop(k) for k in due]
+
+    def load(self):
+        """Loads the buffered changes."""
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                self.entries = {f"{e['url']}|{e['name']}": DigestEntry.from_dict(e) for e in json.load(f)}
+        except (ValueError, KeyError, FileNotFoundError):
+            self.entries = {}
+
+    def save(self):
+        """Saves and syncs the buffered changes, if they changed."""
+        if not self._dirty:
+            return
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        with open(self.path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump([e.to_dict() for e in self.entries.values()], f, indent=1)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(self.path + ".tmp", self.path)
+        self._dirty = False
+
+
+def publish_digest(entry, outbox):
+    """
+    Adds the summary of a digest to the outbox.
+
+    :param entry: The digest whose window ended.
+    :param outbox: The outbox where the messages are added.
+    :type entry: DigestEntry
+    :type outbox: Outbox
+    """
+    embeds = build_embeds(entry.changes)
+    if not embeds:
+        log.info(f"{entry.name} - Digest had no changes left.")
+        return
+    member_count = entry.member_count if entry.member_count != entry.member_count_before else 0
+    messages = build_messages(embeds, entry.name, entry.avatar, member_count)
+    key = hashlib.sha1(f"{entry.url}|{entry.name}|{entry.started}".encode("utf-8")).hexdigest()[:16]
+    log.info(f"{entry.name} - Publishing digest with {len(entry.changes)} changes.")
+    outbox.add_messages(key, entry.url, messages)
+
+
+def compare_levels(guilds, milestone_step=100, milestone_min=100, promotions=True):
+    """
+    Compares the levels and vocations of the members of many guilds, to find level milestones and promotions.
+
+    Milestones are only reached when a member passes the highest level they had, so members dying and leveling back
+    up are not announced again. The highest level is carried over to the current state of the guild.
+
+    :param guilds: The previous and current state of every guild scanned.
+    :type guilds: list of tuple of GuildRoster
+    :param milestone_step: Milestones are reached every time a multiple of this level is reached. 0 to disable.
+    :type milestone_step: int
+    :param milestone_min: Milestones below this level are not reported.
+    :type milestone_min: int
+    :param promotions: Whether to report vocation promotions or not.
+    :type promotions: bool
+    :return: The changes found for every guild, in the same order as given.
+    :rtype: list of list of Change
+    """
+    changes = []
+    for before, after in guilds:
+        guild_changes = []
+        previous = {m.name.lower(): m for m in before.members}
+        for member in after.members:
+            member_before = previous.get(member.name.lower())
+            if member_before is None:
+                continue
+            member.peak_level = max(member_before.peak_level, member.level)
+            if milestone_step > 0 and member.level // milestone_step > member_before.peak_level // milestone_step:
+                milestone = member.level // milestone_step * milestone_step
+                if milestone >= milestone_min:
+                    log.info("Member reached level %d: %s" % (milestone, member.name))
+                    guild_changes.append(Change(ChangeType.LEVEL_MILESTONE, member, milestone))
+            promoted = member.vocation != member_before.vocation and member.vocation.base == member_before.vocation
+            if promotions and promoted:
+                log.info("Member promoted to %s: %s" % (member.vocation.value, member.name))
+                guild_changes.append(Change(ChangeType.VOCATION_PROMOTED, member, member_before.vocation))
+        changes.append(guild_changes)
+    return changes
+
+
+def compare_world_guilds(before, after):
+    """
+    Compares the guild list of a world at different points in time, to find created, disbanded and renamed guilds.
+
+    A guild is considered renamed if a guild that disappeared and a new guild have the same, non-empty, description.
+
+    :param before: The guild list in the previous saved state.
+    :type before: list of tibiapy.models.GuildEntry
+    :param after: The current guild list.
+    :type after: list of tibiapy.models.GuildEntry
+    :return: A list of all the changes found.
+    :rtype: list of Change
+    """
+    changes = []
+    before_names = {g.name for g in before}
+    after_names = {g.name for g in after}
+    disbanded = [g for g in before if g.name not in after_names]
+    created = [g for g in after if g.name not in before_names]
+    for guild in disbanded[:]:
+        if not guild.description:
+            continue
+        for new_guild in created:
+            if new_guild.description == guild.description:
+                created.remove(new_guild)
+                disbanded.remove(guild)
+                log.info("Guild %s renamed to %s" % (guild.name, new_guild.name))
+                changes.append(Change(ChangeType.GUILD_RENAMED, extra=(guild.name, new_guild.name)))
+                break
+    for guild in disbanded:
+        log.info("Guild disbanded: %s" % guild.name)
+        changes.append(Change(ChangeType.GUILD_DISBANDED, extra=guild.name))
+    for guild in created:
+        log.info("New guild found: %s" % guild.name)
+        changes.append(Change(ChangeType.GUILD_CREATED, extra=guild.name))
+    return changes
+
+
+def schedule_world_scans(before, after, last_scans, now, max_age, limit):
+    """
+    Selects which guilds of a world need a full scan.
+
+    Guilds that are new, or whose entry in the guild list changed, are always scheduled. Guilds whose entry looks the
+    same are only scheduled once their data is older than ``max_age``, oldest first and up to ``limit`` guilds, so
+    the cost of a cycle depends on the activity of the world rather than its size.
+
+    :param before: The guild list in the previous saved state.
+    :type before: list of tibiapy.models.GuildEntry
+    :param after: The current guild list.
+    :type after: list of tibiapy.models.GuildEntry
+    :param last_scans: The timestamp of the last full scan of each guild, or :obj:`None` if never scanned.
+    :type last_scans: dict of str, float
+    :param now: The current timestamp.
+    :type now: float
+    :param max_age: The maximum time in seconds a guild can go without being scanned.
+    :type max_age: int
+    :param limit: The maximum number of unchanged guilds to scan.
+    :type limit: int
+    :return: The names of the guilds to scan.
+    :rtype: list of str
+    """
+    previous = {g.name: g.model_dump() for g in before}
+    scheduled = []
+    stale = []
+    for entry in after:
+        last_scan = last_scans.get(entry.name)
+        if last_scan is None or previous.get(entry.name) != entry.model_dump():
+            scheduled.append(entry.name)
+        elif now - last_scan >= max_age:
+            stale.append(entry.name)
+    stale.sort(key=lambda n: last_scans[n])
+    return scheduled + stale[:limit]
+
+
 def get_vocation_emoji(vocation):
     """Returns an emoji to represent a character's vocation.
 
@@ -429,6 +1853,12 @@ def build_embeds(changes):
     deleted = ""
     new_invites = ""
     removed_invites = ""
+    created_guilds = ""
+    disbanded_guilds = ""
+    renamed_guilds = ""
+    level_milestones = ""
+    vocation_promotions = ""
+    moved = ""
     for change in changes:
         try:
             vocation = get_vocation_abbreviation(change.member.vocation)
@@ -445,6 +1875,9 @@ def build_embeds(changes):
             promoted += FMT_CHANGE.format(m=change.member, v=vocation, e=emoji)
         elif change.type == ChangeType.DELETED:
             deleted += FMT_CHANGE.format(m=change.member, v=vocation, e=emoji)
+        elif change.type == ChangeType.MOVED:
+            moved += FMT_MOVED.format(m=change.member, v=vocation, e=emoji, extra=change.extra,
+                                      url=get_guild_url(change.extra))
         elif change.type == ChangeType.NAME_CHANGE:
             name_changes += FMT_NAME_CHANGE.format(m=change.member, v=vocation, e=emoji, extra=change.extra)
         elif change.type == ChangeType.TITLE_CHANGE:
@@ -468,6 +1901,17 @@ def build_embeds(changes):
         elif change.type == ChangeType.APPLICATIONS_CHANGE:
             embeds.append({"color": CLR_APPLICATIONS, "title": "Guild application status changed",
                           "description": f"Applications are now {'open' if change.extra else 'closed'}."})
+        elif change.type == ChangeType.LEVEL_MILESTONE:
+            level_milestones += FMT_LEVEL_MILESTONE.format(m=change.member, v=vocation, e=emoji, extra=change.extra)
+        elif change.type == ChangeType.VOCATION_PROMOTED:
+            vocation_promotions += FMT_VOCATION_PROMOTED.format(m=change.member, v=vocation, e=emoji,
+                                                                extra=get_vocation_abbreviation(change.extra))
+        elif change.type == ChangeType.GUILD_CREATED:
+            created_guilds += FMT_GUILD.format(extra=change.extra, url=get_guild_url(change.extra))
+        elif change.type == ChangeType.GUILD_DISBANDED:
+            disbanded_guilds += FMT_GUILD.format(extra=change.extra, url=get_guild_url(change.extra))
+        elif change.type == ChangeType.GUILD_RENAMED:
+            renamed_guilds += FMT_GUILD_RENAMED.format(extra=change.extra, url=get_guild_url(change.extra[1]))
 
     if new_members:
         messages = split_message(new_members)
@@ -483,6 +1927,10 @@ def build_embeds(changes):
         messages = split_message(removed)
         for message in messages:
             embeds.append({"color": CLR_REMOVED_MEMBER, "title": "Member left or kicked", "description": message})
+    if moved:
+        messages = split_message(moved)
+        for message in messages:
+            embeds.append({"color": CLR_MOVED, "title": "Member moved to another guild", "description": message})
     if promoted:
         messages = split_message(promoted)
         for message in messages:
@@ -511,23 +1959,43 @@ def build_embeds(changes):
         messages = split_message(new_invites)
         for message in messages:
             embeds.append({"color": CLR_NEW_INVITE, "title": "New invites", "description": message})
+    if level_milestones:
+        messages = split_message(level_milestones)
+        for message in messages:
+            embeds.append({"color": CLR_LEVEL_MILESTONE, "title": "Level milestones", "description": message})
+    if vocation_promotions:
+        messages = split_message(vocation_promotions)
+        for message in messages:
+            embeds.append({"color": CLR_VOCATION_PROMOTED, "title": "Vocation promotions", "description": message})
+    if created_guilds:
+        messages = split_message(created_guilds)
+        for message in messages:
+            embeds.append({"color": CLR_GUILD_CREATED, "title": "New guilds", "description": message})
+    if disbanded_guilds:
+        messages = split_message(disbanded_guilds)
+        for message in messages:
+            embeds.append({"color": CLR_GUILD_DISBANDED, "title": "Guilds disbanded", "description": message})
+    if renamed_guilds:
+        messages = split_message(renamed_guilds)
+        for message in messages:
+            embeds.append({"color": CLR_GUILD_RENAMED, "title": "Guilds renamed", "description": message})
     return embeds
 
 
-def publish_changes(url, embeds, name=None, avatar=None, new_count=0):
+def build_messages(embeds, name=None, avatar=None, new_count=0):
     """
-    Publish changes to discord through a webhook
+    Builds the webhook message bodies containing the embeds.
 
-    :param url: The webhook's URL
     :param embeds: List of dictionaries, containing the embeds with changes.
     :param name: The poster's name, if None, the name assigned when creating the webhook will be used.
     :param avatar: The URL to the avatar to use, if None, the avatar assigned at creation will be used.
     :param new_count: The new guild member count. If 0, no mention will be made.
-    :type url: str
     :type embeds: list of dict
     :type name: str
     :type avatar: str
     :type new_count: int
+    :return: The message bodies.
+    :rtype: list of dict
     """
     # Webhook messages have a limit of 6000 characters
     # Can't display more than 10 embeds in one message
@@ -540,12 +2008,12 @@ def publish_changes(url, embeds, name=None, avatar=None, new_count=0):
             batches.append(current_batch)
             current_length = 0
             current_batch = []
-            continue
         current_batch.append(embed)
         current_length += length
 
     batches.append(current_batch)
 
+    messages = []
     for i, batch in enumerate(batches):
         body = {
             "username": name,
@@ -554,10 +2022,437 @@ def publish_changes(url, embeds, name=None, avatar=None, new_count=0):
         }
         if i == 0 and new_count > 0:
             body["content"] = "The guild now has **%d** members." % new_count
+        messages.append(body)
+    return messages
+
+
+def post_message(url, body):
+    """
+    Posts a message to discord through a webhook.
+
+    :param url: The webhook's URL
+    :param body: The message's body.
+    :type url: str
+    :type body: dict
+    :return: Whether the message was posted or not.
+    :rtype: bool
+    :raises WebhookRejected: If the webhook rejected the message and retrying won't help, e.g. it was deleted.
+    """
+    try:
+        r = requests.post(url, data=json.dumps(body), headers={"Content-Type": "application/json"})
+        r.raise_for_status()
+    except requests.HTTPError as e:
+        status = e.response.status_code if e.response is not None else None
+        if status is not None and 400 <= status < 500 and status not in RETRYABLE_STATUSES:
+            raise WebhookRejected(f"Webhook responded with status {status}") from e
+        log.error("Couldn't publish changes.")
+        return False
+    except requests.RequestException:
+        log.error("Couldn't publish changes.")
+        return False
+    return True
+
+
+def publish_changes(url, embeds, name=None, avatar=None, new_count=0):
+    """
+    Publish changes to discord through a webhook
+
+    :param url: The webhook's URL
+    :param embeds: List of dictionaries, containing the embeds with changes.
+    :param name: The poster's name, if None, the name assigned when creating the webhook will be used.
+    :param avatar: The URL to the avatar to use, if None, the avatar assigned at creation will be used.
+    :param new_count: The new guild member count. If 0, no mention will be made.
+    :type url: str
+    :type embeds: list of dict
+    :type name: str
+    :type avatar: str
+    :type new_count: int
+    """
+    try:
+        for body in build_messages(embeds, name, avatar, new_count):
+            post_message(url, body)
+    except WebhookRejected as e:
+        log.error(f"Couldn't publish changes: {e}")
+
+
+class GuildScan:
+    """
+    The result of scanning a guild, pending to be published.
+
+    :ivar cfg_guild: The guild that was scanned.
+    :ivar before: The previous state of the guild.
+    :ivar after: The current state of the guild.
+    :ivar changes: The changes found.
+    :ivar elapsed: The seconds spent scanning the guild so far.
+    :type cfg_guild: ConfigGuild
+    :type before: GuildRoster
+    :type after: GuildRoster
+    :type changes: list of Change
+    :type elapsed: float
+    """
+    def __init__(self, cfg_guild, before, after, changes, elapsed=0):
+        self.cfg_guild = cfg_guild
+        self.before = before
+        self.after = after
+        self.changes = changes
+        self.elapsed = elapsed
+
+    def __repr__(self):
+        return "<%s name=%r changes=%d>" % (self.__class__.__name__, self.cfg_guild.name, len(self.changes))
+
+
+def fetch_guild(name, breaker=None, deadline=None):
+    """
+    Fetches a guild, unless it is in cool-down for failing recently.
+
+    :param name: The name of the guild.
+    :param breaker: The circuit breaker keeping track of failing targets.
+    :param deadline: The time limit to fetch the guild, as a :func:`time.monotonic` value.
+    :type name: str
+    :type breaker: CircuitBreaker
+    :type deadline: float
+    :return: The guild, or :obj:`None` if it couldn't be fetched.
+    :rtype: tibiapy.Guild
+    :raises DeadlineExceeded: If the guild couldn't be fetched before the deadline.
+    """
+    key = f"guild:{name}"
+    if breaker is not None and not breaker.allow(key):
+        log.info(f"{name} - Skipped, guild failed recently.")
+        return None
+    try:
+        guild = get_guild(name, deadline=deadline)
+    except FetchError:
+        log.error(f"{name} - Error: Couldn't fetch guild")
+        if breaker is not None:
+            breaker.record_failure(key, False)
+        return None
+    if guild is None:
+        log.error(f"{name} - Error: Guild doesn't exist")
+        if breaker is not None:
+            breaker.record_failure(key, True)
+        return None
+    if breaker is not None:
+        breaker.record_success(key)
+    return guild
+
+
+def scan_guild(cfg_guild, rosters, deadline=None, breaker=None):
+    """
+    Fetches the current state of a single guild.
+
+    :param cfg_guild: The guild to scan.
+    :param rosters: The last known state of every guild, by name. Updated with the new state of the guild.
+    :param deadline: The time limit to fetch the guild, as a :func:`time.monotonic` value.
+    :param breaker: The circuit breaker keeping track of failing targets.
+    :type cfg_guild: ConfigGuild
+    :type rosters: dict of str, GuildRoster
+    :type deadline: float
+    :type breaker: CircuitBreaker
+    :return: The result of the scan, without changes, or :obj:`None` if there was no previous data to compare to.
+    :rtype: GuildScan
+    :raises DeadlineExceeded: If the guild couldn't be fetched before the deadline.
+    """
+    name = cfg_guild.name
+    guild_file = f"{name}.json"
+    guild_data = rosters.get(name)
+    if guild_data is None:
+        guild_data = load_data(guild_file)
+    if guild_data is None:
+        log.info(f"{name} - No previous data found. Saving current data...")
+        guild_data = fetch_guild(name, breaker, deadline)
+        if guild_data is None:
+            return
+        save_data(guild_file, guild_data)
+        rosters[name] = GuildRoster.from_guild(guild_data)
+        log.info(f"{name} - Data saved.")
+        return
+    if isinstance(guild_data, Guild):
+        guild_data = GuildRoster.from_guild(guild_data)
+
+    log.info(f"{name} - Scanning guild...")
+    new_guild_data = fetch_guild(name, breaker, deadline)
+    if new_guild_data is None:
+        return
+    new_guild_data = GuildRoster.from_guild(new_guild_data)
+    rosters[name] = new_guild_data
+    log.info(f"{name} - Scanning done")
+    time.sleep(2)
+    return GuildScan(cfg_guild, guild_data, new_guild_data, [])
+
+
+def queue_scan(scan, outbox, digest=None):
+    """
+    Adds the changes of a guild scan to the outbox, or saves the guild's data if there are no changes.
+
+    If the guild has a digest window, the changes are added to the digest instead.
+
+    :param scan: The result of the scan.
+    :param outbox: The outbox where the messages are added.
+    :param digest: The digest where changes of guilds with a digest window are buffered.
+    :type scan: GuildScan
+    :type outbox: Outbox
+    :type digest: Digest
+    """
+    name = scan.cfg_guild.name
+    guild_file = f"{name}.json"
+    if not scan.changes:
+        save_data(guild_file, scan.after)
+        log.info(f"{name} - Data saved.")
+        return
+    if digest is not None and scan.cfg_guild.digest_window > 0:
+        digest.add(scan.cfg_guild.webhook_url, scan.before.name, scan.after.logo_url, scan.cfg_guild.digest_window,
+                   scan.changes, scan.before.member_count, scan.after.member_count, scan.after.ranks)
+        # The data is saved once the digest is saved and the outbox is committed.
+        outbox.defer(guild_file, scan.after)
+        return
+    member_count = scan.after.member_count
+    # Only publish count if it changed
+    if member_count == scan.before.member_count:
+        member_count = 0
+    embeds = build_embeds(scan.changes)
+    messages = build_messages(embeds, scan.before.name, scan.after.logo_url, member_count)
+    # The data is saved along with the messages, once the outbox is committed.
+    outbox.add(guild_file, scan.after, scan.cfg_guild.webhook_url, messages)
+
+
+def discover_world(cfg, cfg_world, worlds, rosters, outbox, sinks=()):
+    """
+    Fetches the guild list of a world, announcing guilds created, disbanded or renamed.
+
+    :param cfg: The configuration, used for the scan intervals.
+    :param cfg_world: The world to check.
+    :param worlds: The last known guild list of every world, by name. Updated with the new list.
+    :param rosters: The last known state of every guild, by name. Disbanded and renamed guilds are updated.
+    :param outbox: The outbox where the messages are added.
+    :param sinks: The sinks where the changes are emitted.
+    :type cfg: Config
+    :type cfg_world: ConfigWorld
+    :type worlds: dict of str, list of tibiapy.models.GuildEntry
+    :type rosters: dict of str, GuildRoster
+    :type outbox: Outbox
+    :type sinks: list of EventSink
+    :return: The guilds of the world that should be scanned this cycle.
+    :rtype: list of ConfigGuild
+    """
+    name = cfg_world.name
+    world_file = f"world_{name}.json"
+    before = worlds.get(name)
+    if before is None:
+        section = load_data(world_file, GuildsSection)
+        before = section.entries if section else None
+    log.info(f"{name} - Fetching guild list...")
+    try:
+        section = get_world_guilds(name, deadline=time.monotonic() + cfg.guild_budget)
+    except DeadlineExceeded:
+        log.warning(f"{name} - Fetching guild list took longer than {cfg.guild_budget} seconds.")
+        return []
+    except FetchError:
+        log.error(f"{name} - Error: Couldn't fetch guild list")
+        return []
+    if section is None or section.world is None:
+        log.error(f"{name} - Error: World doesn't exist")
+        return []
+    after = section.entries
+    worlds[name] = after
+    changes = []
+    if before is None:
+        log.info(f"{name} - No previous guild list found, all guilds will be scanned.")
+        before = after
+    else:
+        changes = compare_world_guilds(before, after)
+        for change in changes:
+            if change.type == ChangeType.GUILD_DISBANDED:
+                rosters.pop(change.extra, None)
+            elif change.type == ChangeType.GUILD_RENAMED:
+                old_name, new_name = change.extra
+                if old_name in rosters:
+                    roster = rosters.pop(old_name)
+                    roster.name = new_name
+                    rosters[new_name] = roster
+                try:
+                    os.replace(os.path.join("data", f"{old_name}.json"), os.path.join("data", f"{new_name}.json"))
+                except FileNotFoundError:
+                    pass
+    if changes:
+        emit_events(sinks, changes, world=name)
+        outbox.add(world_file, section, cfg_world.webhook_url, build_messages(build_embeds(changes), name))
+    else:
+        save_data(world_file, section)
+
+    last_scans = {}
+    for entry in after:
+        try:
+            last_scans[entry.name] = os.path.getmtime(os.path.join("data", f"{entry.name}.json"))
+        except OSError:
+            last_scans[entry.name] = None
+    scheduled = schedule_world_scans(before, after, last_scans, time.time(), cfg.discovery_interval,
+                                     max(1, len(after) * cfg.interval // cfg.discovery_interval))
+    log.info(f"{name} - {len(scheduled)} of {len(after)} guilds scheduled for scanning.")
+    return [ConfigGuild(guild_name, cfg_world.webhook_url, cfg_world.digest_window) for guild_name in scheduled]
+
+
+class CycleStats:
+    """
+    Statistics of a scan cycle.
+
+    :ivar started: The time when the cycle started, as a timestamp.
+    :ivar duration: The seconds the cycle took.
+    :ivar lag: The seconds the cycle took beyond the configured interval.
+    :ivar scanned: The number of guilds scanned.
+    :ivar overrun: The names of the guilds that exceeded their time budget.
+    :ivar deferred: The removed members that couldn't be looked up, by guild name.
+    :ivar breakers: The targets in cool-down, by key.
+    :type started: float
+    :type duration: float
+    :type lag: float
+    :type scanned: int
+    :type overrun: list of str
+    :type deferred: dict of str, list of str
+    :type breakers: dict of str, dict
+    """
+    def __init__(self, started):
+        self.started = started
+        self.duration = 0
+        self.lag = 0
+        self.scanned = 0
+        self.overrun = []
+        self.deferred = {}
+        self.breakers = {}
+
+    def __repr__(self):
+        return "<%s duration=%.1f lag=%.1f scanned=%d overrun=%d>" % (self.__class__.__name__, self.duration,
+                                                                      self.lag, self.scanned, len(self.overrun))
+
+    def to_dict(self):
+        return {
+            "started": self.started,
+            "duration": self.duration,
+            "lag": self.lag,
+            "scanned": self.scanned,
+            "overrun": self.overrun,
+            "deferred": self.deferred,
+            "breakers": self.breakers,
+        }
+
+
+def save_status(stats):
+    """
+    Saves the statistics of the last cycle to ``data/status.json``, so they can be monitored.
+
+    :param stats: The statistics of the last cycle.
+    :type stats: CycleStats
+    """
+    os.makedirs("data", exist_ok=True)
+    path = os.path.join("data", "status.json")
+    with open(path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(stats.to_dict(), f, indent=1)
+    os.replace(path + ".tmp", path)
+
+
+def run_cycle(cfg, rosters, worlds, outbox, joins, carried, breaker, sinks=(), digest=None):
+    """
+    Runs a single scan cycle over all the guilds.
+
+    Every guild has a time budget to be fetched and compared. Guilds that exceed it are left unchanged and carried to
+    the next cycle, where they are scanned first.
+
+    :param cfg: The configuration.
+    :param rosters: The last known state of every guild, by name.
+    :param worlds: The last known guild list of every discovered world, by name.
+    :param outbox: The outbox where the messages are added.
+    :param joins: The index of recent joins to watched guilds.
+    :param carried: The guilds carried from the previous cycle. Replaced by the guilds to carry to the next cycle.
+    :param breaker: The circuit breaker keeping track of failing guilds and characters.
+    :param sinks: The sinks where the changes are emitted.
+    :param digest: The digest where changes of guilds with a digest window are buffered.
+    :type cfg: Config
+    :type rosters: dict of str, GuildRoster
+    :type worlds: dict of str, list of tibiapy.models.GuildEntry
+    :type outbox: Outbox
+    :type joins: JoinIndex
+    :type carried: list of ConfigGuild
+    :type breaker: CircuitBreaker
+    :type sinks: list of EventSink
+    :type digest: Digest
+    :return: The statistics of the cycle.
+    :rtype: CycleStats
+    """
+    stats = CycleStats(time.time())
+    started = time.monotonic()
+    # Guilds carried from the previous cycle go first.
+    targets = {cfg_guild.name: cfg_guild for cfg_guild in carried}
+    carried.clear()
+    for cfg_world in cfg.worlds:
+        for cfg_guild in discover_world(cfg, cfg_world, worlds, rosters, outbox, sinks):
+            targets[cfg_guild.name] = cfg_guild
+    # Guilds in the configuration file are always scanned, with their own webhook.
+    for cfg_guild in cfg.guilds:
+        if cfg_guild.name is None:
+            log.error("Guild is missing name.")
+            time.sleep(5)
+            continue
+        targets[cfg_guild.name] = cfg_guild
+
+    scans = []
+    for cfg_guild in targets.values():
+        guild_started = time.monotonic()
         try:
-            requests.post(url, data=json.dumps(body), headers={"Content-Type": "application/json"})
-        except requests.RequestException:
-            log.error("Couldn't publish changes.")
+            scan = scan_guild(cfg_guild, rosters, guild_started + cfg.guild_budget, breaker)
+        except DeadlineExceeded:
+            log.warning(f"{cfg_guild.name} - Scan took longer than {cfg.guild_budget} seconds, retrying next cycle.")
+            stats.overrun.append(cfg_guild.name)
+            carried.append(cfg_guild)
+            continue
+        if scan:
+            scan.elapsed = time.monotonic() - guild_started
+            scans.append(scan)
+    # All joins are indexed first, so members that moved between guilds are resolved without looking them up.
+    for scan in scans:
+        joins.add_guild(scan.before, scan.after)
+    completed = []
+    for scan in scans:
+        name = scan.cfg_guild.name
+        log.info(f"{name} - Detecting changes.")
+        deferred = []
+        try:
+            scan.changes = compare_guild(scan.before, scan.after, joins,
+                                         time.monotonic() + cfg.guild_budget - scan.elapsed, breaker, deferred)
+        except DeadlineExceeded:
+            log.warning(f"{name} - Scan took longer than {cfg.guild_budget} seconds, retrying next cycle.")
+            # The guild is left as it was, so the same changes are found next cycle.
+            rosters[name] = scan.before
+            stats.overrun.append(name)
+            carried.append(scan.cfg_guild)
+            continue
+        if deferred:
+            stats.deferred[name] = [m.name for m in deferred]
+        completed.append(scan)
+    joins.next_cycle()
+    # Level and vocation changes are compared for all guilds at once.
+    level_changes = compare_levels([(scan.before, scan.after) for scan in completed], cfg.level_milestone_step,
+                                   cfg.level_milestone_min, cfg.vocation_promotions)
+    for scan, changes in zip(completed, level_changes):
+        scan.changes.extend(changes)
+    for scan in completed:
+        emit_events(sinks, scan.changes, scan.after.name, scan.after.world)
+        queue_scan(scan, outbox, digest)
+    for sink in sinks:
+        sink.flush()
+    if digest is not None:
+        for entry in digest.pop_due():
+            publish_digest(entry, outbox)
+        # Digests are published before they are removed from the file, and buffered before the data is saved.
+        outbox.write()
+        digest.save()
+    outbox.commit()
+
+    stats.scanned = len(completed)
+    stats.breakers = breaker.report()
+    stats.duration = time.monotonic() - started
+    stats.lag = max(stats.duration - cfg.interval, 0)
+    if stats.lag:
+        log.warning(f"Cycle took {stats.duration:.0f} seconds, {stats.lag:.0f} seconds longer than the interval.")
+    return stats
 
 
 def scan_guilds():
@@ -565,46 +2460,35 @@ def scan_guilds():
     if not cfg.webhook_url:
         log.error("Missing Webhook URL in config.yml")
         exit()
-    while True:
-        # Iterate through each guild in the configuration file
-        for cfg_guild in cfg.guilds:
-            name = cfg_guild.name
-            if name is None:
-                log.error("Guild is missing name.")
-                time.sleep(5)
-                continue
-            guild_file = f"{name}.json"
-            guild_data = load_data(guild_file)
-            if guild_data is None:
-                log.info(f"{name} - No previous data found. Saving current data...")
-                guild_data = get_guild(name)
-                if guild_data is None:
-                    log.error(f"{name} - Error: Guild doesn't exist")
-                    continue
-                save_data(guild_file, guild_data)
-                log.info(f"{name} - Data saved.")
-                continue
-
-            log.info(f"{name} - Scanning guild...")
-            new_guild_data = get_guild(name)
-            if new_guild_data is None:
-                log.error(f"{name} - Error: Guild doesn't exist")
-                continue
-            save_data(guild_file, new_guild_data)
-            log.info(f"{name} - Data saved.")
-            log.info(f"{name} - Detecting changes.")
-            # Looping through members
-            member_count_before = guild_data.member_count
-            member_count = new_guild_data.member_count
-            # Only publish count if it changed
-            if member_count == member_count_before:
-                member_count = 0
-            changes = compare_guild(guild_data, new_guild_data)
-            embeds = build_embeds(changes)
-            publish_changes(cfg_guild.webhook_url, embeds, guild_data.name, new_guild_data.logo_url, member_count)
-            log.info(f"{name} - Scanning done")
-            time.sleep(2)
-        time.sleep(cfg.interval)
+    # Last known state of every guild, kept in memory to avoid reading the data files every cycle.
+    rosters = {}
+    # Last known guild list of every discovered world.
+    worlds = {}
+    outbox = Outbox()
+    outbox.recover()
+    joins = JoinIndex()
+    # Guilds that exceeded their time budget, to be scanned first on the next cycle.
+    carried = []
+    breaker = CircuitBreaker()
+    breaker.load()
+    try:
+        sinks = [create_sink(options) for options in cfg.sinks]
+    except (ValueError, TypeError) as e:
+        log.error("Invalid sink in config.yml.\nError: %s" % e)
+        exit()
+    digest = Digest()
+    digest.load()
+    try:
+        while True:
+            stats = run_cycle(cfg, rosters, worlds, outbox, joins, carried, breaker, sinks, digest)
+            breaker.save()
+            save_status(stats)
+            # Cycles start every interval, unless the previous cycle took longer.
+            time.sleep(max(cfg.interval - stats.duration, 0))
+    finally:
+        # Events still buffered are written before exiting.
+        for sink in sinks:
+            sink.close()
 
 
 if __name__ == "__main__":
@@ -1,12 +1,18 @@
 import copy
 import datetime
+import json
 import logging
+import os
+import socket
+import tempfile
+import time
 import unittest
 from datetime import date
 from unittest.mock import MagicMock, patch, mock_open
 
 import requests
-from tibiapy import Guild, GuildMember, Character, GuildInvite, Vocation, GuildHouse
+from tibiapy.enums import Vocation
+from tibiapy.models import Character, Guild, GuildEntry, GuildHouse, GuildInvite, GuildMember, GuildsSection
 
 import guildwatcher
 from guildwatcher import Change, ChangeType
@@ -14,23 +20,34 @@ from guildwatcher import Change, ChangeType
 logger = logging.getLogger(guildwatcher.__name__)
 
 
+def make_member(name, rank, level, vocation, title=None):
+    return GuildMember(name=name, rank=rank, title=title, level=level, vocation=vocation, joined_on=date.today(),
+                       is_online=False)
+
+
+def make_character(name):
+    # Only the name of characters is used, so validation of the remaining fields is skipped.
+    return Character.model_construct(name=name)
+
+
 class TestGuildWatcher(unittest.TestCase):
     def setUp(self):
-        self.guild = Guild("Test Guild", "Antica")
-        self.guild.guildhall = GuildHouse("Crystal Glance", self.guild.world)
         today = datetime.date.today()
+        self.guild = Guild(name="Test Guild", world="Antica", logo_url="", founded=today, active=True,
+                           active_war=False, members=[], invites=[])
+        self.guild.guildhall = GuildHouse(name="Crystal Glance", paid_until=today)
         self.guild.members = [
-            GuildMember("Galarzaa", "Leader", level=285, vocation=Vocation.ROYAL_PALADIN, joined=today),
-            GuildMember("Nezune", "Vice", level=412, vocation=Vocation.ELITE_KNIGHT, title="Nab", joined=today),
-            GuildMember("Ondskan", "Vice", level=437, vocation=Vocation.ROYAL_PALADIN, joined=today),
-            GuildMember("Faenryz", "Vice", level=207, vocation=Vocation.ROYAL_PALADIN, joined=today),
-            GuildMember("Tschis", "Elite", level=205, vocation=Vocation.DRUID, joined=today),
-            GuildMember("John Doe", "Elite", level=34, vocation=Vocation.MASTER_SORCERER, joined=today),
-            GuildMember("Jane Doe", "Recruit", level=55, vocation=Vocation.SORCERER, joined=today),
-            GuildMember("Fahgnoli", "Recruit", level=404, vocation=Vocation.MASTER_SORCERER, joined=today)
+            make_member("Galarzaa", "Leader", 285, Vocation.ROYAL_PALADIN),
+            make_member("Nezune", "Vice", 412, Vocation.ELITE_KNIGHT, title="Nab"),
+            make_member("Ondskan", "Vice", 437, Vocation.ROYAL_PALADIN),
+            make_member("Faenryz", "Vice", 207, Vocation.ROYAL_PALADIN),
+            make_member("Tschis", "Elite", 205, Vocation.DRUID),
+            make_member("John Doe", "Elite", 34, Vocation.MASTER_SORCERER),
+            make_member("Jane Doe", "Recruit", 55, Vocation.SORCERER),
+            make_member("Fahgnoli", "Recruit", 404, Vocation.MASTER_SORCERER)
         ]
         self.guild.invites = [
-            GuildInvite("Xzilla")
+            GuildInvite(name="Xzilla", invited_on=today)
         ]
         self.guild_after = copy.deepcopy(self.guild)
 
@@ -92,6 +109,29 @@ class TestGuildWatcher(unittest.TestCase):
         self.assertEqual("Bald Dwarfs", cfg.guilds[1].name)
         self.assertEqual(second_webhook, cfg.guilds[1].webhook_url)
 
+    def test_config_worlds(self):
+        """Testing a config file with worlds to discover."""
+        webhook_url = "http://discord.webhook.url.goes.here"
+        second_webhook = "http://another.webhook.url"
+        content = """
+        webhook_url: %s
+        discovery_interval: 1800
+
+        worlds:
+        - Antica
+        - name: Secura
+          webhook_url: %s
+        """ % (webhook_url, second_webhook)
+        with patch('builtins.open', new_callable=mock_open, read_data=content):
+            cfg = guildwatcher.load_config()
+
+        self.assertEqual(1800, cfg.discovery_interval)
+        self.assertEqual(2, len(cfg.worlds))
+        self.assertEqual("Antica", cfg.worlds[0].name)
+        self.assertEqual(webhook_url, cfg.worlds[0].webhook_url)
+        self.assertEqual("Secura", cfg.worlds[1].name)
+        self.assertEqual(second_webhook, cfg.worlds[1].webhook_url)
+
     def test_new_guildhall(self):
         self.guild.guildhall = None
         changes = guildwatcher.compare_guild(self.guild, self.guild_after)
@@ -125,7 +165,7 @@ class TestGuildWatcher(unittest.TestCase):
         self.assertEqual(changes[0].member.rank, demoted_member.rank)
 
     def test_new_member(self):
-        new_member = GuildMember("Noob", "Recruit", level=12, vocation="Knight")
+        new_member = make_member("Noob", "Recruit", 12, Vocation.KNIGHT)
         self.guild_after.members.append(new_member)
 
         changes = guildwatcher.compare_guild(self.guild, self.guild_after)
@@ -153,19 +193,19 @@ class TestGuildWatcher(unittest.TestCase):
         changes = guildwatcher.compare_guild(self.guild, self.guild_after)
         self.assertEqual(changes[0].type, guildwatcher.ChangeType.DELETED)
         self.assertEqual(changes[0].member.name, kicked.name)
-        guildwatcher.get_character.assert_called_with(kicked.name)
+        guildwatcher.get_character.assert_called_with(kicked.name, deadline=None)
 
     def test_member_kicked(self):
         # Kick member at position 1
         kicked = self.guild_after.members.pop(1)
 
         # Mock get_character to imitate existing character
-        guildwatcher.get_character = MagicMock(return_value=Character(name=kicked.name))
+        guildwatcher.get_character = MagicMock(return_value=make_character(kicked.name))
 
         changes = guildwatcher.compare_guild(self.guild, self.guild_after)
         self.assertEqual(changes[0].type, guildwatcher.ChangeType.REMOVED)
         self.assertEqual(changes[0].member.name, kicked.name)
-        guildwatcher.get_character.assert_called_with(kicked.name)
+        guildwatcher.get_character.assert_called_with(kicked.name, deadline=None)
 
     def test_member_name_changed(self):
         # Change name of first member
@@ -175,17 +215,17 @@ class TestGuildWatcher(unittest.TestCase):
         affected_member.name = new_name
 
         # Checking the missing character should return the new name
-        guildwatcher.get_character = MagicMock(return_value=Character(name=new_name))
+        guildwatcher.get_character = MagicMock(return_value=make_character(new_name))
 
         changes = guildwatcher.compare_guild(self.guild, self.guild_after)
         self.assertEqual(changes[0].type, guildwatcher.ChangeType.NAME_CHANGE)
         self.assertEqual(changes[0].member.name, new_name)
         self.assertEqual(changes[0].extra, old_name)
-        guildwatcher.get_character.assert_called_with(old_name)
+        guildwatcher.get_character.assert_called_with(old_name, deadline=None)
 
     def test_invite_accepted(self):
         joining_member = self.guild_after.invites.pop()
-        self.guild_after.members.append(GuildMember(joining_member.name, "Recruit", None, 400, Vocation.MASTER_SORCERER))
+        self.guild_after.members.append(make_member(joining_member.name, "Recruit", 400, Vocation.MASTER_SORCERER))
 
         changes = guildwatcher.compare_guild(self.guild, self.guild_after)
         self.assertEqual(changes[0].type, guildwatcher.ChangeType.NEW_MEMBER)
@@ -199,7 +239,7 @@ class TestGuildWatcher(unittest.TestCase):
         self.assertEqual(changes[0].member.name, joining_member.name)
 
     def test_new_invite(self):
-        new_invite = GuildInvite("Pecorino")
+        new_invite = GuildInvite(name="Pecorino", invited_on=date.today())
         self.guild_after.invites.append(new_invite)
 
         changes = guildwatcher.compare_guild(self.guild, self.guild_after)
@@ -216,19 +256,16 @@ class TestGuildWatcher(unittest.TestCase):
 
     def test_embeds(self):
         changes = [
-            Change(ChangeType.NEW_MEMBER, GuildMember("Noob", "Recruit", level=19, vocation=Vocation.DRUID)),
-            Change(ChangeType.REMOVED, GuildMember("John", "Member", level=56, vocation=Vocation.DRUID, joined=date.today())),
-            Change(ChangeType.NAME_CHANGE, GuildMember("Tschis", "Vice", level=205, vocation=Vocation.DRUID), "Tschas"),
-            Change(ChangeType.DELETED, GuildMember("Botter", "Vice", level=444, vocation=Vocation.ELITE_KNIGHT,
-                                                   joined=date.today())),
-            Change(ChangeType.TITLE_CHANGE, GuildMember("Nezune", level=404, rank="Vice", vocation=Vocation.ELITE_KNIGHT,
-                                                        title="Nab"), "Challenge Pls"),
-            Change(ChangeType.PROMOTED, GuildMember("Old", "Rank", level=142, vocation=Vocation.ROYAL_PALADIN,
-                                                    joined=date.today())),
-            Change(ChangeType.DEMOTED, GuildMember("Jane", "Rank", level=89, vocation=Vocation.MASTER_SORCERER,
-                                                   joined=date.today())),
-            Change(ChangeType.INVITE_REMOVED, GuildInvite("Unwanted", date=date.today())),
-            Change(ChangeType.NEW_INVITE, GuildInvite("Good Guy", date=date.today())),
+            Change(ChangeType.NEW_MEMBER, make_member("Noob", "Recruit", 19, Vocation.DRUID)),
+            Change(ChangeType.REMOVED, make_member("John", "Member", 56, Vocation.DRUID)),
+            Change(ChangeType.NAME_CHANGE, make_member("Tschis", "Vice", 205, Vocation.DRUID), "Tschas"),
+            Change(ChangeType.DELETED, make_member("Botter", "Vice", 444, Vocation.ELITE_KNIGHT)),
+            Change(ChangeType.TITLE_CHANGE, make_member("Nezune", "Vice", 404, Vocation.ELITE_KNIGHT, title="Nab"),
+                   "Challenge Pls"),
+            Change(ChangeType.PROMOTED, make_member("Old", "Rank", 142, Vocation.ROYAL_PALADIN)),
+            Change(ChangeType.DEMOTED, make_member("Jane", "Rank", 89, Vocation.MASTER_SORCERER)),
+            Change(ChangeType.INVITE_REMOVED, GuildInvite(name="Unwanted", invited_on=date.today())),
+            Change(ChangeType.NEW_INVITE, GuildInvite(name="Good Guy", invited_on=date.today())),
             Change(ChangeType.GUILDHALL_REMOVED, None, "Crystal Glance"),
             Change(ChangeType.GUILDHALL_CHANGED, None, "The Tibianic"),
             Change(ChangeType.APPLICATIONS_CHANGE, extra=True),
@@ -245,3 +282,627 @@ class TestGuildWatcher(unittest.TestCase):
         requests.post = MagicMock()
         guildwatcher.publish_changes("https://canary.discordapp.com/api/webhooks/webhook", embeds)
         self.assertTrue(requests.post.call_count)
+
+    def test_roster_round_trip(self):
+        roster = guildwatcher.GuildRoster.from_guild(self.guild)
+        guild = roster.to_guild()
+
+        self.assertEqual(self.guild.model_dump(), guild.model_dump())
+        self.assertEqual(self.guild.ranks, roster.ranks)
+        self.assertEqual(self.guild.member_count, roster.member_count)
+
+    def test_roster_save(self):
+        roster = guildwatcher.GuildRoster.from_guild(self.guild)
+        self.assertEqual(guildwatcher.data_digest(self.guild), guildwatcher.data_digest(roster))
+
+    def test_roster_compare(self):
+        promoted_member = self.guild_after.members[6]
+        promoted_member.rank = "Elite"
+        before = guildwatcher.GuildRoster.from_guild(self.guild)
+        after = guildwatcher.GuildRoster.from_guild(self.guild_after)
+
+        changes = guildwatcher.compare_guild(before, after)
+        self.assertEqual(changes[0].type, guildwatcher.ChangeType.PROMOTED)
+        self.assertIsInstance(changes[0].member, guildwatcher.RosterMember)
+        self.assertEqual(changes[0].member.name, promoted_member.name)
+
+    def test_world_guilds_changes(self):
+        before = [
+            GuildEntry(name="Redd Alliance", logo_url="", world="Antica", active=True, description="We are Redd"),
+            GuildEntry(name="Bald Dwarfs", logo_url="", world="Antica", active=True),
+        ]
+        after = [
+            GuildEntry(name="Redd Alliance Reborn", logo_url="", world="Antica", active=True, description="We are Redd"),
+            GuildEntry(name="Academy", logo_url="", world="Antica", active=False),
+        ]
+
+        changes = guildwatcher.compare_world_guilds(before, after)
+        types = {c.type: c.extra for c in changes}
+        self.assertEqual(("Redd Alliance", "Redd Alliance Reborn"), types[ChangeType.GUILD_RENAMED])
+        self.assertEqual("Bald Dwarfs", types[ChangeType.GUILD_DISBANDED])
+        self.assertEqual("Academy", types[ChangeType.GUILD_CREATED])
+        self.assertTrue(guildwatcher.build_embeds(changes))
+
+    def test_world_guilds_schedule(self):
+        before = [
+            GuildEntry(name="Redd Alliance", logo_url="", world="Antica", active=True),
+            GuildEntry(name="Bald Dwarfs", logo_url="", world="Antica", active=True),
+            GuildEntry(name="Academy", logo_url="", world="Antica", active=True),
+            GuildEntry(name="Old Guild", logo_url="", world="Antica", active=True),
+        ]
+        after = copy.deepcopy(before)
+        after[1].description = "New description"
+        after.append(GuildEntry(name="New Guild", logo_url="", world="Antica", active=False))
+        last_scans = {"Redd Alliance": 900, "Bald Dwarfs": 900, "Academy": 100, "Old Guild": 50}
+
+        scheduled = guildwatcher.schedule_world_scans(before, after, last_scans, 1000, 500, 1)
+        self.assertEqual(["Bald Dwarfs", "New Guild", "Old Guild"], scheduled)
+
+    @patch('guildwatcher.get_world_guilds')
+    def test_world_guild_renamed(self, get_world_guilds):
+        before = [GuildEntry(name="Test Guild", logo_url="", world="Antica", active=True, description="Tests")]
+        after = [GuildEntry(name="Test Guild Reborn", logo_url="", world="Antica", active=True, description="Tests")]
+        get_world_guilds.return_value = GuildsSection(world="Antica", entries=after, available_worlds=["Antica"])
+        cfg = guildwatcher.Config(webhook_url="https://webhook", worlds=["Antica"])
+        rosters = {"Test Guild": guildwatcher.GuildRoster.from_guild(self.guild)}
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            cwd = os.getcwd()
+            os.chdir(tmp_dir)
+            try:
+                guildwatcher.save_data("Test Guild.json", self.guild)
+                guildwatcher.discover_world(cfg, cfg.worlds[0], {"Antica": before}, rosters, MagicMock())
+                self.assertTrue(os.path.exists(os.path.join("data", "Test Guild Reborn.json")))
+                self.assertFalse(os.path.exists(os.path.join("data", "Test Guild.json")))
+            finally:
+                os.chdir(cwd)
+        self.assertEqual(["Test Guild Reborn"], list(rosters))
+        self.assertEqual("Test Guild Reborn", rosters["Test Guild Reborn"].name)
+
+    @patch('requests.post')
+    def test_outbox_redelivery(self, post):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            cwd = os.getcwd()
+            os.chdir(tmp_dir)
+            try:
+                post.side_effect = requests.ConnectionError()
+                outbox = guildwatcher.Outbox()
+                outbox.add("guild.json", self.guild_after, "http://webhook", [{"embeds": []}, {"embeds": []}])
+                outbox.commit()
+                self.assertEqual(1, len(outbox.pending))
+                self.assertIsNotNone(guildwatcher.load_data("guild.json"))
+
+                post.side_effect = None
+                outbox = guildwatcher.Outbox()
+                outbox.recover()
+                self.assertFalse(outbox.pending)
+                self.assertEqual(3, post.call_count)
+            finally:
+                os.chdir(cwd)
+
+    @patch('requests.post')
+    def test_outbox_discard_unsaved(self, post):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            cwd = os.getcwd()
+            os.chdir(tmp_dir)
+            try:
+                guildwatcher.save_data("guild.json", self.guild)
+                outbox = guildwatcher.Outbox()
+                outbox.add("guild.json", self.guild_after, "http://webhook", [{"embeds": []}])
+                # The process stops after the entry is written, before the data file is saved.
+                outbox.write()
+
+                outbox = guildwatcher.Outbox()
+                outbox.recover()
+                self.assertFalse(outbox.pending)
+                post.assert_not_called()
+            finally:
+                os.chdir(cwd)
+
+    @patch('requests.post')
+    def test_outbox_redelivery_after_save(self, post):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            cwd = os.getcwd()
+            os.chdir(tmp_dir)
+            try:
+                post.side_effect = requests.ConnectionError()
+                guildwatcher.save_data("guild.json", self.guild)
+                outbox = guildwatcher.Outbox()
+                outbox.add("guild.json", self.guild_after, "http://webhook", [{"content": "joined"}])
+                outbox.commit()
+                # The guild changes again while the webhook is still down, so the data file is saved again.
+                self.guild_after.members.pop()
+                outbox.add("guild.json", self.guild_after, "http://webhook", [{"content": "left"}])
+                outbox.commit()
+
+                post.reset_mock()
+                post.side_effect = None
+                outbox = guildwatcher.Outbox()
+                outbox.recover()
+                self.assertFalse(outbox.pending)
+                self.assertEqual(['{"content": "joined"}', '{"content": "left"}'],
+                                 [c.kwargs["data"] for c in post.call_args_list])
+            finally:
+                os.chdir(cwd)
+
+    @patch('requests.post')
+    def test_outbox_webhook_order(self, post):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            outbox = guildwatcher.Outbox(os.path.join(tmp_dir, "outbox.ndjson"))
+            post.side_effect = [requests.ConnectionError(), MagicMock()]
+            outbox.add_messages("joined", "http://webhook", [{"content": "joined"}])
+            outbox.add_messages("left", "http://webhook", [{"content": "left"}])
+            outbox.add_messages("other", "http://other.webhook", [{"content": "other"}])
+            outbox.write()
+            outbox.deliver()
+            self.assertEqual(['{"content": "joined"}', '{"content": "other"}'],
+                             [c.kwargs["data"] for c in post.call_args_list])
+            self.assertEqual(["joined", "left"], list(outbox.pending))
+
+            post.reset_mock()
+            post.side_effect = None
+            outbox.deliver()
+            self.assertEqual(['{"content": "joined"}', '{"content": "left"}'],
+                             [c.kwargs["data"] for c in post.call_args_list])
+            self.assertFalse(outbox.pending)
+
+    @patch('requests.post')
+    def test_outbox_give_up(self, post):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            outbox = guildwatcher.Outbox(os.path.join(tmp_dir, "outbox.ndjson"))
+            response = requests.Response()
+            response.status_code = 404
+            post.return_value = response
+            outbox.add_messages("deleted", "http://deleted.webhook", [{"embeds": []}])
+            outbox.write()
+            outbox.deliver()
+            self.assertFalse(outbox.pending)
+
+            post.return_value = None
+            post.side_effect = requests.ConnectionError()
+            outbox.add_messages("down", "http://down.webhook", [{"embeds": []}])
+            outbox.write()
+            for _ in range(guildwatcher.OUTBOX_MAX_ATTEMPTS - 1):
+                outbox.deliver()
+            self.assertIn("down", outbox.pending)
+            outbox.deliver()
+            self.assertFalse(outbox.pending)
+            self.assertEqual(0, os.path.getsize(outbox.path))
+
+    def test_level_changes(self):
+        self.guild_after.members[0].level = 301
+        self.guild_after.members[5].level = 99
+        self.guild_after.members[6].vocation = Vocation.MASTER_SORCERER
+        other_guild = guildwatcher.GuildRoster.from_guild(self.guild)
+        guilds = [
+            (other_guild, other_guild),
+            (guildwatcher.GuildRoster.from_guild(self.guild), guildwatcher.GuildRoster.from_guild(self.guild_after)),
+        ]
+
+        changes = guildwatcher.compare_levels(guilds, 100, 100)
+        self.assertFalse(changes[0])
+        self.assertEqual(2, len(changes[1]))
+        self.assertEqual(ChangeType.LEVEL_MILESTONE, changes[1][0].type)
+        self.assertEqual("Galarzaa", changes[1][0].member.name)
+        self.assertEqual(300, changes[1][0].extra)
+        self.assertEqual(ChangeType.VOCATION_PROMOTED, changes[1][1].type)
+        self.assertEqual("Jane Doe", changes[1][1].member.name)
+        self.assertEqual(Vocation.SORCERER, changes[1][1].extra)
+        self.assertTrue(guildwatcher.build_embeds(changes[1]))
+
+    def test_level_changes_thresholds(self):
+        self.guild_after.members[5].level = 50
+        self.guild_after.members[6].vocation = Vocation.MASTER_SORCERER
+        guilds = [
+            (guildwatcher.GuildRoster.from_guild(self.guild), guildwatcher.GuildRoster.from_guild(self.guild_after)),
+        ]
+
+        self.assertFalse(guildwatcher.compare_levels(guilds, 50, 100, False)[0])
+        self.assertEqual(1, len(guildwatcher.compare_levels(guilds, 50, 0, False)[0]))
+
+    def test_level_changes_milestone_once(self):
+        self.guild.members[0].level = 299
+        levels = [300, 299, 300, 301, 400]
+        before = guildwatcher.GuildRoster.from_guild(self.guild)
+        milestones = []
+        for level in levels:
+            self.guild.members[0].level = level
+            after = guildwatcher.GuildRoster.from_guild(self.guild)
+            milestones.append([c.extra for c in guildwatcher.compare_levels([(before, after)])[0]])
+            before = after
+        self.assertEqual([[300], [], [], [], [400]], milestones)
+
+    def test_member_moved(self):
+        # Move member at position 3 to another watched guild
+        moved = self.guild_after.members.pop(3)
+        before = guildwatcher.GuildRoster.from_guild(self.guild)
+        after = guildwatcher.GuildRoster.from_guild(self.guild_after)
+        other_guild = guildwatcher.GuildRoster("Other Guild", "Antica", "", date.today(), True)
+        other_guild_after = guildwatcher.GuildRoster("Other Guild", "Antica", "", date.today(), True,
+                                                     [guildwatcher.RosterMember.from_member(moved)])
+
+        joins = guildwatcher.JoinIndex()
+        joins.add_guild(before, after)
+        joins.add_guild(other_guild, other_guild_after)
+        guildwatcher.get_character = MagicMock(return_value=None)
+
+        changes = guildwatcher.compare_guild(before, after, joins)
+        self.assertEqual(changes[0].type, guildwatcher.ChangeType.MOVED)
+        self.assertEqual(changes[0].member.name, moved.name)
+        self.assertEqual(changes[0].extra, "Other Guild")
+        guildwatcher.get_character.assert_not_called()
+        self.assertTrue(guildwatcher.build_embeds(changes))
+
+    def test_join_index_cycles(self):
+        before = guildwatcher.GuildRoster.from_guild(self.guild)
+        after = guildwatcher.GuildRoster.from_guild(self.guild)
+        after.members.append(guildwatcher.RosterMember("Newbie", "Recruit", None, 8, Vocation.NONE, date.today()))
+
+        joins = guildwatcher.JoinIndex(cycles=2)
+        joins.add_guild(before, after)
+        self.assertEqual("Test Guild", joins.find("newbie", "Other Guild"))
+        self.assertIsNone(joins.find("Newbie", "Test Guild"))
+        joins.next_cycle()
+        self.assertEqual("Test Guild", joins.find("Newbie"))
+        joins.next_cycle()
+        self.assertIsNone(joins.find("Newbie"))
+
+    def test_timeout(self):
+        self.assertIsNone(guildwatcher.get_timeout(None))
+        self.assertGreater(guildwatcher.get_timeout(time.monotonic() + 10), 0)
+        with self.assertRaises(guildwatcher.DeadlineExceeded):
+            guildwatcher.get_timeout(time.monotonic() - 1)
+
+    def test_member_check_deadline(self):
+        self.guild_after.members.pop(1)
+
+        def get_character(name, tries=5, deadline=None):
+            guildwatcher.get_timeout(deadline)
+            return None
+
+        guildwatcher.get_character = MagicMock(side_effect=get_character)
+
+        with self.assertRaises(guildwatcher.DeadlineExceeded):
+            guildwatcher.compare_guild(self.guild, self.guild_after, deadline=time.monotonic() - 1)
+        changes = guildwatcher.compare_guild(self.guild, self.guild_after, deadline=time.monotonic() + 10)
+        self.assertEqual(changes[0].type, guildwatcher.ChangeType.DELETED)
+
+    @patch('time.sleep')
+    @patch('requests.post')
+    @patch('guildwatcher.get_character')
+    @patch('guildwatcher.get_guild')
+    def test_run_cycle_carried(self, get_guild, get_character, post, sleep):
+        other = copy.deepcopy(self.guild)
+        other.name = "Other Guild"
+        kicked = self.guild_after.members.pop(6)
+        current = {"Test Guild": self.guild_after, "Other Guild": other}
+        get_guild.side_effect = lambda name, deadline=None: copy.deepcopy(current[name])
+        get_character.side_effect = guildwatcher.DeadlineExceeded()
+        cfg = guildwatcher.Config(webhook_url="http://webhook", interval=0, guilds=["Other Guild", "Test Guild"])
+        before = guildwatcher.GuildRoster.from_guild(self.guild)
+        rosters = {"Test Guild": before, "Other Guild": guildwatcher.GuildRoster.from_guild(other)}
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            cwd = os.getcwd()
+            os.chdir(tmp_dir)
+            try:
+                outbox = guildwatcher.Outbox()
+                joins = guildwatcher.JoinIndex()
+                breaker = guildwatcher.CircuitBreaker()
+                carried = []
+                # Looking up the removed member exceeds the budget, so the guild is reverted and carried.
+                stats = guildwatcher.run_cycle(cfg, rosters, {}, outbox, joins, carried, breaker)
+                self.assertEqual(["Test Guild"], stats.overrun)
+                self.assertEqual(["Test Guild"], [g.name for g in carried])
+                self.assertIs(before, rosters["Test Guild"])
+                self.assertEqual(1, stats.scanned)
+                self.assertEqual(stats.duration, stats.lag)
+                post.assert_not_called()
+                guildwatcher.save_status(stats)
+                with open(os.path.join("data", "status.json")) as f:
+                    self.assertEqual(["Test Guild"], json.load(f)["overrun"])
+
+                get_guild.reset_mock()
+                get_character.side_effect = None
+                get_character.return_value = make_character(kicked.name)
+                stats = guildwatcher.run_cycle(cfg, rosters, {}, outbox, joins, carried, breaker)
+                self.assertEqual(["Test Guild", "Other Guild"], [c.args[0] for c in get_guild.call_args_list])
+                self.assertEqual([], stats.overrun)
+                self.assertFalse(carried)
+                self.assertEqual(2, stats.scanned)
+                self.assertEqual(1, post.call_count)
+                self.assertIn(kicked.name, post.call_args.kwargs["data"])
+
+                post.reset_mock()
+                guildwatcher.run_cycle(cfg, rosters, {}, outbox, joins, carried, breaker)
+                post.assert_not_called()
+            finally:
+                os.chdir(cwd)
+
+    @patch('time.sleep')
+    @patch('requests.post')
+    @patch('guildwatcher.get_guild')
+    def test_run_cycle_digest(self, get_guild, post, sleep):
+        self.guild_after.members.append(make_member("Noob", "Recruit", 12, Vocation.KNIGHT))
+        get_guild.side_effect = lambda name, deadline=None: copy.deepcopy(self.guild_after)
+        cfg = guildwatcher.Config(webhook_url="http://webhook", digest_window=600, guilds=["Test Guild"])
+        rosters = {"Test Guild": guildwatcher.GuildRoster.from_guild(self.guild)}
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            cwd = os.getcwd()
+            os.chdir(tmp_dir)
+            try:
+                args = (guildwatcher.Outbox(), guildwatcher.JoinIndex(), [], guildwatcher.CircuitBreaker(), (),
+                        guildwatcher.Digest())
+                digest = args[-1]
+                guildwatcher.run_cycle(cfg, rosters, {}, *args)
+                post.assert_not_called()
+                self.assertEqual(1, len(digest.entries))
+                self.assertTrue(os.path.exists(digest.path))
+                self.assertEqual(self.guild_after.member_count, guildwatcher.load_data("Test Guild.json").member_count)
+
+                # The window ends, the buffered changes are published once.
+                for entry in digest.entries.values():
+                    entry.started = 0
+                guildwatcher.run_cycle(cfg, rosters, {}, *args)
+                self.assertEqual(1, post.call_count)
+                self.assertIn("Noob", post.call_args.kwargs["data"])
+                self.assertFalse(digest.entries)
+            finally:
+                os.chdir(cwd)
+
+    def test_circuit_breaker(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            breaker = guildwatcher.CircuitBreaker(os.path.join(tmp_dir, "breakers.json"), 60, 3600, 7200)
+            breaker.record_failure("guild:Missing", True, now=1000)
+            breaker.record_failure("guild:Flaky", False, now=1000)
+            breaker.record_failure("guild:Flaky", False, now=1000)
+            self.assertFalse(breaker.allow("guild:Missing", now=1000))
+            self.assertTrue(breaker.allow("guild:Missing", now=4600))
+            self.assertTrue(breaker.is_missing("guild:Missing"))
+            self.assertFalse(breaker.allow("guild:Flaky", now=1119))
+            self.assertTrue(breaker.allow("guild:Flaky", now=1120))
+            self.assertFalse(breaker.is_missing("guild:Flaky"))
+            self.assertTrue(breaker.allow("guild:Other"))
+
+            breaker.save(now=1000)
+            loaded = guildwatcher.CircuitBreaker(breaker.path)
+            loaded.load()
+            self.assertEqual(breaker.states, loaded.states)
+            self.assertEqual({"guild:Missing"}, set(loaded.report(now=1500)))
+
+            loaded.record_success("guild:Missing")
+            self.assertTrue(loaded.allow("guild:Missing", now=1000))
+
+    def test_member_deleted_cached(self):
+        kicked = self.guild_after.members.pop(6)
+        guildwatcher.get_character = MagicMock(return_value=None)
+        breaker = guildwatcher.CircuitBreaker()
+
+        changes = guildwatcher.compare_guild(self.guild, self.guild_after, breaker=breaker)
+        self.assertEqual(changes[0].type, guildwatcher.ChangeType.DELETED)
+        self.assertTrue(breaker.is_missing(f"character:{kicked.name}"))
+
+        guildwatcher.get_character.reset_mock()
+        changes = guildwatcher.compare_guild(self.guild, self.guild_after, breaker=breaker)
+        self.assertEqual(changes[0].type, guildwatcher.ChangeType.DELETED)
+        guildwatcher.get_character.assert_not_called()
+
+    def test_member_check_failing(self):
+        kicked = self.guild_after.members.pop(6)
+        guildwatcher.get_character = MagicMock(side_effect=guildwatcher.FetchError())
+        breaker = guildwatcher.CircuitBreaker(error_cooldown=0)
+
+        before = guildwatcher.GuildRoster.from_guild(self.guild)
+        for _ in range(guildwatcher.MEMBER_MAX_FAILURES - 1):
+            after = guildwatcher.GuildRoster.from_guild(self.guild_after)
+            deferred = []
+            changes = guildwatcher.compare_guild(before, after, breaker=breaker, deferred=deferred)
+            self.assertFalse(changes)
+            self.assertEqual([kicked.name], [m.name for m in deferred])
+            self.assertEqual([kicked.name], [m.name for m in after.deferred])
+            self.assertEqual(len(self.guild_after.members), after.member_count)
+            before = after
+
+        after = guildwatcher.GuildRoster.from_guild(self.guild_after)
+        changes = guildwatcher.compare_guild(before, after, breaker=breaker)
+        self.assertEqual(ChangeType.REMOVED, changes[0].type)
+        self.assertEqual(kicked.name, changes[0].member.name)
+        self.assertFalse(after.deferred)
+
+    def test_member_renamed_check_failing(self):
+        self.guild_after.members[0].name = "Galarzaa Fidera"
+        guildwatcher.get_character = MagicMock(side_effect=guildwatcher.FetchError())
+        breaker = guildwatcher.CircuitBreaker(error_cooldown=0)
+        before = guildwatcher.GuildRoster.from_guild(self.guild)
+        after = guildwatcher.GuildRoster.from_guild(self.guild_after)
+
+        changes = guildwatcher.compare_guild(before, after, breaker=breaker)
+        self.assertEqual([ChangeType.NEW_MEMBER], [c.type for c in changes])
+        self.assertEqual(["Galarzaa"], [m.name for m in after.deferred])
+
+        # The lookup works on the next scan, the new member is matched to the renamed character.
+        guildwatcher.get_character = MagicMock(return_value=make_character("Galarzaa Fidera"))
+        before, after = after, guildwatcher.GuildRoster.from_guild(self.guild_after)
+        changes = guildwatcher.compare_guild(before, after, breaker=breaker)
+        self.assertEqual(1, len(changes))
+        self.assertEqual(ChangeType.NAME_CHANGE, changes[0].type)
+        self.assertEqual("Galarzaa Fidera", changes[0].member.name)
+        self.assertEqual("Galarzaa", changes[0].extra)
+        self.assertFalse(after.deferred)
+
+    @patch('time.sleep')
+    @patch('requests.post')
+    @patch('guildwatcher.get_character')
+    @patch('guildwatcher.get_guild')
+    def test_run_cycle_deferred(self, get_guild, get_character, post, sleep):
+        kicked = self.guild_after.members.pop(6)
+        self.guild_after.members.append(make_member("Noob", "Recruit", 12, Vocation.KNIGHT))
+        self.guild_after.members.append(make_member("Newbie", "Recruit", 15, Vocation.DRUID))
+        get_guild.side_effect = lambda name, deadline=None: copy.deepcopy(self.guild_after)
+        get_character.side_effect = guildwatcher.FetchError()
+        cfg = guildwatcher.Config(webhook_url="http://webhook", guilds=["Test Guild"])
+        rosters = {"Test Guild": guildwatcher.GuildRoster.from_guild(self.guild)}
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            cwd = os.getcwd()
+            os.chdir(tmp_dir)
+            try:
+                stats = guildwatcher.run_cycle(cfg, rosters, {}, guildwatcher.Outbox(), guildwatcher.JoinIndex(), [],
+                                               guildwatcher.CircuitBreaker())
+                self.assertEqual({"Test Guild": [kicked.name]}, stats.deferred)
+                self.assertEqual([], stats.overrun)
+                self.assertEqual(1, post.call_count)
+                body = json.loads(post.call_args.kwargs["data"])
+                self.assertEqual("The guild now has **9** members.", body["content"])
+                self.assertEqual(9, guildwatcher.load_data("Test Guild.json").member_count)
+                self.assertEqual([kicked.name], [m.name for m in rosters["Test Guild"].deferred])
+            finally:
+                os.chdir(cwd)
+
+    def test_serialize_change(self):
+        change = Change(ChangeType.NEW_DISBAND_WARNING, None, ("condition", datetime.date(2018, 8, 17)))
+        event = guildwatcher.serialize_change(change, "Test Guild", "Antica", 0)
+        self.assertEqual({
+            "version": guildwatcher.EVENT_SCHEMA_VERSION,
+            "time": "1970-01-01T00:00:00+00:00",
+            "type": "NEW_DISBAND_WARNING",
+            "guild": "Test Guild",
+            "world": "Antica",
+            "member": None,
+            "extra": ["condition", "2018-08-17"],
+        }, event)
+
+        member = self.guild.members[0]
+        event = guildwatcher.serialize_change(Change(ChangeType.NEW_MEMBER, member), "Test Guild")
+        self.assertEqual(member.name, event["member"]["name"])
+        self.assertEqual(member.vocation.value, event["member"]["vocation"])
+        json.dumps(event)
+
+    def test_file_sink(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, "events.ndjson")
+            sink = guildwatcher.create_sink({"type": "file", "path": path, "max_bytes": 1000, "backup_count": 1,
+                                             "batch_size": 5})
+            changes = [Change(ChangeType.NEW_MEMBER, m) for m in self.guild.members]
+            guildwatcher.emit_events([sink], changes, "Test Guild")
+            sink.flush()
+            guildwatcher.emit_events([sink], changes, "Test Guild")
+            sink.close()
+
+            self.assertTrue(os.path.exists(path + ".1"))
+            self.assertFalse(os.path.exists(path + ".2"))
+            with open(path) as f:
+                events = [json.loads(line) for line in f]
+            self.assertTrue(events)
+            self.assertTrue(all(e["type"] == "NEW_MEMBER" for e in events))
+
+    def test_socket_sink_unavailable(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            sink = guildwatcher.create_sink({"type": "socket", "path": os.path.join(tmp_dir, "missing.sock"),
+                                             "max_pending": 5})
+            changes = [Change(ChangeType.NEW_MEMBER, m) for m in self.guild.members]
+            guildwatcher.emit_events([sink], changes, "Test Guild")
+            sink.flush()
+
+            self.assertEqual(len(changes) - 5, sink.dropped)
+
+    def test_socket_sink_partial_send(self):
+        sink = guildwatcher.UnixSocketSink("unused.sock", batch_size=2)
+        received = bytearray()
+
+        def send(limit):
+            def _send(data):
+                if len(received) >= limit:
+                    raise limit_error
+                count = min(len(data), limit - len(received))
+                received.extend(data[:count])
+                return count
+            return _send
+
+        # The socket stops accepting data in the middle of a batch.
+        limit_error = socket.timeout()
+        sink._socket = MagicMock()
+        sink._socket.send.side_effect = send(10)
+        guildwatcher.emit_events([sink], [Change(ChangeType.NEW_MEMBER, m) for m in self.guild.members[:2]])
+        sink._socket.send.side_effect = send(10 ** 6)
+        sink.flush()
+        lines = received.decode().splitlines()
+        self.assertEqual(["Galarzaa", "Nezune"], [json.loads(line)["member"]["name"] for line in lines])
+
+        # The connection is lost in the middle of the second line of a batch.
+        received.clear()
+        limit_error = BrokenPipeError()
+        sink._socket.send.side_effect = send(len(lines[0]) + 5)
+        guildwatcher.emit_events([sink], [Change(ChangeType.NEW_MEMBER, m) for m in self.guild.members[:2]])
+        self.assertIsNone(sink._socket)
+        received.clear()
+        sink._socket = MagicMock()
+        sink._socket.send.side_effect = send(10 ** 6)
+        sink.flush()
+        self.assertEqual(["Nezune"], [json.loads(line)["member"]["name"] for line in received.decode().splitlines()])
+
+    def test_unknown_sink(self):
+        with self.assertRaises(ValueError):
+            guildwatcher.create_sink({"type": "carrier pigeon"})
+
+    def test_merge_changes(self):
+        member = guildwatcher.RosterMember("Galarzaa", "Leader", None, 300, Vocation.ELDER_DRUID, date(2018, 1, 1))
+        other = guildwatcher.RosterMember("Nezune", "Member", "Hey", 200, Vocation.KNIGHT, date(2018, 1, 1))
+        invite = guildwatcher.RosterInvite("Tschas", date(2018, 1, 1))
+        changes = guildwatcher.merge_changes([Change(ChangeType.NEW_MEMBER, member),
+                                              Change(ChangeType.NEW_INVITE, invite),
+                                              Change(ChangeType.TITLE_CHANGE, other, "Old")],
+                                             [Change(ChangeType.PROMOTED, member)])
+        self.assertEqual(4, len(changes))
+        renamed = guildwatcher.RosterMember("Nezune", "Member", "Old", 200, Vocation.KNIGHT, date(2018, 1, 1))
+        changes = guildwatcher.merge_changes(changes, [Change(ChangeType.REMOVED, member),
+                                                       Change(ChangeType.INVITE_REMOVED, invite),
+                                                       Change(ChangeType.APPLICATIONS_CHANGE, extra=True)])
+        self.assertEqual([ChangeType.TITLE_CHANGE, ChangeType.APPLICATIONS_CHANGE], [c.type for c in changes])
+        changes = guildwatcher.merge_changes(changes, [Change(ChangeType.TITLE_CHANGE, renamed, "Hey"),
+                                                       Change(ChangeType.APPLICATIONS_CHANGE, extra=False)])
+        self.assertEqual([], changes)
+
+    def test_merge_rank_changes(self):
+        def member(rank):
+            return guildwatcher.RosterMember("Galarzaa", rank, None, 300, Vocation.ELDER_DRUID, date(2018, 1, 1))
+
+        ranks = ["Leader", "Vice", "Member", "Recruit"]
+        changes = guildwatcher.merge_changes([Change(ChangeType.PROMOTED, member("Leader"), "Recruit")],
+                                             [Change(ChangeType.DEMOTED, member("Vice"), "Leader")], ranks)
+        self.assertEqual(1, len(changes))
+        self.assertEqual(ChangeType.PROMOTED, changes[0].type)
+        self.assertEqual("Vice", changes[0].member.rank)
+        self.assertEqual("Recruit", changes[0].extra)
+
+        changes = guildwatcher.merge_changes(changes, [Change(ChangeType.DEMOTED, member("Recruit"), "Vice")], ranks)
+        self.assertEqual([], changes)
+
+    def test_digest(self):
+        member = guildwatcher.RosterMember("Galarzaa", "Leader", None, 300, Vocation.ELDER_DRUID, date(2018, 1, 1))
+        invite = guildwatcher.RosterInvite("Tschas", date(2018, 1, 1))
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            digest = guildwatcher.Digest(os.path.join(tmp_dir, "digest.json"))
+            digest.add("https://webhook", "Test Guild", None, 600,
+                       [Change(ChangeType.NEW_MEMBER, member), Change(ChangeType.NEW_INVITE, invite),
+                        Change(ChangeType.NEW_DISBAND_WARNING, extra=("condition", date(2018, 8, 17)))],
+                       10, 11, now=1000)
+            digest.save()
+            self.assertEqual([], digest.pop_due(now=1500))
+
+            digest = guildwatcher.Digest(digest.path)
+            digest.load()
+            digest.add("https://webhook", "Test Guild", None, 600, [Change(ChangeType.INVITE_REMOVED, invite)],
+                       11, 11, now=1200)
+            entries = digest.pop_due(now=1600)
+            self.assertEqual(1, len(entries))
+            entry = entries[0]
+            self.assertEqual(1000, entry.started)
+            self.assertEqual([ChangeType.NEW_MEMBER, ChangeType.NEW_DISBAND_WARNING], [c.type for c in entry.changes])
+            self.assertEqual(Vocation.ELDER_DRUID, entry.changes[0].member.vocation)
+            self.assertEqual(date(2018, 8, 17), entry.changes[1].extra[1])
+            self.assertEqual({}, digest.entries)
+
+            outbox = guildwatcher.Outbox(os.path.join(tmp_dir, "outbox.ndjson"))
+            guildwatcher.publish_digest(entry, outbox)
+            self.assertEqual(1, len(outbox.pending))
+            guildwatcher.publish_digest(guildwatcher.DigestEntry("https://webhook", "Test Guild", None, 0, 600, 10, 10),
+                                        outbox)
+            self.assertEqual(1, len(outbox.pending))